@@ -0,0 +1,71 @@
+"""Bytes per comment held in memory: raw spot.im dicts vs. projected dicts vs. Comments.
+
+Run from the repository root:
+
+    python -m bench.bench_comment_memory --comments=100000
+
+Synthetic pages from bench.bench_offline are serialized and parsed back like a
+real response, then each representation of the parsed comments is measured with
+tracemalloc while it is alive, along with the time to score it.
+"""
+import json
+import time
+import tracemalloc
+
+import click
+
+from bench.bench_offline import make_comment
+from src import get_yahoo_comments as gyc
+
+
+def project_dict(comment):
+    """the dict projection _project_comment returned before Comment records"""
+    projected = {
+        "id": comment["id"],
+        "time": comment["time"],
+        "user_id": comment.get("user_id"),
+        "replies_count": comment.get("replies_count", 0),
+    }
+    labels = gyc._comment_labels(comment)
+    if labels:
+        projected["additional_data"] = {"labels": {"ids": labels}}
+    return projected
+
+
+def traced_bytes(build):
+    """bytes still allocated once build() returns, and its result"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return tracemalloc.get_traced_memory()[0] - before, result
+    finally:
+        tracemalloc.stop()
+
+
+@click.command()
+@click.option("--comments", default=100_000, help="Number of synthetic comments to hold")
+def main(comments):
+    body = json.dumps([make_comment(i) for i in range(comments)]).encode()
+
+    rows = [
+        ("raw spot.im dicts", lambda: gyc._loads_json(body)),
+        ("projected dicts", lambda: [project_dict(c) for c in gyc._loads_json(body)]),
+        ("Comment records", lambda: [gyc.Comment.from_dict(c) for c in gyc._loads_json(body)]),
+    ]
+    expected = None
+    print(f"{comments:,} comments")
+    print(f"{'representation':<20} {'bytes/comment':>14} {'score seconds':>14}")
+    for name, build in rows:
+        size, data = traced_bytes(build)
+        start = time.perf_counter()
+        result = gyc.score_comments(data)
+        elapsed = time.perf_counter() - start
+        expected = expected or result
+        assert result == expected, f"{name} scores differently"
+        print(f"{name:<20} {size / comments:>14,.0f} {elapsed:>14.3f}")
+        del data
+
+
+if __name__ == "__main__":
+    main()
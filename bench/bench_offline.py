@@ -0,0 +1,207 @@
+"""End-to-end throughput against a local stand-in for Yahoo and spot.im.
+
+Run from the repository root:
+
+    python -m bench.bench_offline --comments=20000 --depths=1000,5000,20000 --concurrency=1,4,16
+
+A stub server in a child process serves synthetic community pages and paginated
+conversation/read responses, with configurable latency and error rate. The module
+is pointed at it through YAHOO_BASE_URL / SPOTIM_BASE_URL and each run scores
+--symbols symbols with get_comment_data + score_comments, reporting comments/s,
+pages/s and the traced peak memory of scoring one symbol at that depth.
+"""
+import json
+import multiprocessing
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+from src import get_yahoo_comments as gyc
+
+NEWEST_TIME = 1732500000
+STEP = 30  # seconds between two synthetic comments
+
+
+def make_comment(index):
+    """a synthetic comment, newest first by index, nested like a real spot.im one"""
+    rng = random.Random(index)
+    return {
+        "id": f"c{index}",
+        "time": NEWEST_TIME - index * STEP,
+        "user_id": f"u_{rng.randrange(5000)}",
+        "root_comment": f"c{index}",
+        "parent_id": "",
+        "depth": 0,
+        "status": "approved",
+        "rank": {"ranks_up": rng.randrange(20), "ranks_down": rng.randrange(5)},
+        "replies_count": 0,
+        "replies": [],
+        "content": [{"type": "text", "text": "to the moon " * rng.randrange(1, 20)}],
+        "additional_data": {
+            "labels": {"ids": rng.choice([["BULLISH"], ["BEARISH"], [], [], ["BULLISH", "BEARISH"]])}
+        },
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real services
+    comments = 0
+    latency = 0.0
+    error_rate = 0.0
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def page(comments, offset, count):
+        page_comments = [make_comment(i) for i in range(offset, min(offset + count, comments))]
+        users = {
+            comment["user_id"]: {"id": comment["user_id"], "display_name": comment["user_id"]}
+            for comment in page_comments
+        }
+        return json.dumps(
+            {
+                "conversation": {
+                    "comments": page_comments,
+                    "users": users,
+                    "has_next": offset + count < comments,
+                    "offset": offset + len(page_comments),
+                }
+            }
+        ).encode()
+
+    def reply(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond(self, body, content_type="application/json"):
+        time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            return self.reply(503, b"{}")
+        self.reply(200, body, content_type)
+
+    def do_GET(self):
+        symbol = self.path.split("/")[2]
+        config = {"config": {"spotId": "sp_bench", "uuid": f"{symbol}_conversation"}}
+        body = f'<html><script id="spotim-config">{json.dumps(config)}</script></html>'
+        self.respond(body.encode(), "text/html")
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.respond(self.page(self.comments, payload["offset"], payload["count"]))
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port_queue, comments, latency, error_rate):
+    handler = type(
+        "Handler", (StubHandler,), dict(comments=comments, latency=latency, error_rate=error_rate)
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+class StubServer:
+    """runs the stub in a child process so it does not compete for our GIL"""
+
+    def __init__(self, comments, latency=0.0, error_rate=0.0):
+        self.args = (comments, latency, error_rate)
+
+    def __enter__(self):
+        port_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve, args=(port_queue,) + self.args, daemon=True
+        )
+        self.process.start()
+        return f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+
+def score(symbol, start_date):
+    conversation_info = gyc.get_conversation_info(symbol)
+    comments = gyc.get_comment_data(conversation_info, start_date, NEWEST_TIME)
+    result = gyc.score_comments(comments)
+    result["comments"] = len(comments)
+    return result
+
+
+def run(symbols, depth, concurrency):
+    """scores the symbols down to depth comments; returns seconds, comments and pages"""
+    start_date = NEWEST_TIME - (depth - 1) * STEP
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda symbol: gyc.profiled(score, symbol, start_date), symbols))
+    elapsed = time.perf_counter() - start
+    assert all(result["comments"] == depth for result in results), "comments missing"
+    return (
+        elapsed,
+        sum(result["comments"] for result in results),
+        sum(result["metrics"]["pages_fetched"] for result in results),
+    )
+
+
+def peak_memory(depth):
+    """traced peak bytes of scoring a single symbol at depth"""
+    tracemalloc.start()
+    try:
+        score("MEM", NEWEST_TIME - (depth - 1) * STEP)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def int_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+@click.command()
+@click.option("--comments", default=20000, help="Comments in each synthetic conversation")
+@click.option("--depths", default="1000,5000,20000", help="Comma separated numbers of newest comments to score")
+@click.option("--concurrency", default="1,4,16", help="Comma separated numbers of symbols fetched at once")
+@click.option("--symbols", default=16, help="Symbols scored per run")
+@click.option("--latency", default=0.01, help="Seconds the stub waits before each response")
+@click.option("--error_rate", default=0.0, help="Share of responses answered with a 503")
+@click.option("--retries", default=3, help="Retries per request, without backoff")
+@click.option("--page_size", default=gyc.DEFAULT_PAGE_SIZE, help="Comments requested per conversation page")
+@click.option("--fetch_workers", default=0, help="Threads fetching the pages of one symbol at once")
+def main(comments, depths, concurrency, symbols, latency, error_rate, retries, page_size, fetch_workers):
+    depths = [min(depth, comments) for depth in int_list(depths)]
+    levels = int_list(concurrency)
+    names = [f"SYM{i}" for i in range(symbols)]
+
+    with StubServer(comments, latency, error_rate) as base_url:
+        gyc.YAHOO_BASE_URL = gyc.SPOTIM_BASE_URL = base_url
+        gyc.configure_http(retries=retries, backoff=0, pool_size=max(levels) * max(1, fetch_workers))
+        gyc.set_page_size(page_size)
+        gyc.set_fetch_workers(fetch_workers)
+
+        print(
+            f"{comments:,} comments per conversation, {symbols} symbols, "
+            f"latency={latency}s, error_rate={error_rate}, page_size={page_size}, "
+            f"fetch_workers={fetch_workers}"
+        )
+        print(f"{'depth':>8} {'concurrency':>12} {'seconds':>9} {'comments/s':>12} {'pages/s':>9} {'peak MB':>8}")
+        for depth in depths:
+            peak = peak_memory(depth) / 2**20
+            for level in levels:
+                elapsed, scored, pages = run(names, depth, level)
+                print(
+                    f"{depth:>8,} {level:>12} {elapsed:>9.3f} {scored / elapsed:>12,.0f} "
+                    f"{pages / elapsed:>9,.1f} {peak:>8.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
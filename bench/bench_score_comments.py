@@ -0,0 +1,67 @@
+"""Throughput of the loop scorer vs. the vectorized (columnar) scorer.
+
+Run from the repository root:
+
+    python -m bench.bench_score_comments --comments=1000000
+"""
+import random
+import time
+
+import click
+
+from src import get_yahoo_comments as gyc
+
+
+def make_comments(count, newest_time=1732500000):
+    """synthetic spot.im comments, newest first, with a realistic label mix"""
+    labels = [["BULLISH"], ["BEARISH"], [], [], ["BULLISH", "BEARISH"]]
+    return [
+        {
+            "id": f"c{i}",
+            "time": newest_time - i,
+            "user_id": f"u_{random.randrange(count // 10 + 1)}",
+            "additional_data": {"labels": {"ids": random.choice(labels)}},
+        }
+        for i in range(count)
+    ]
+
+
+def timed(func, *args, repeat=3, **kwargs):
+    """best wall time of repeat runs, and the last result"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+@click.command()
+@click.option("--comments", default=1_000_000, help="Number of synthetic comments to score")
+@click.option("--record_users", default=True, help="Also collect the bull and bear user ids")
+def main(comments, record_users):
+    comments_data = make_comments(comments)
+
+    loop_time, loop_result = timed(gyc.score_comments, comments_data, record_users=record_users)
+    records = [gyc.Comment.from_dict(comment) for comment in comments_data]
+    records_time, records_result = timed(gyc.score_comments, records, record_users=record_users)
+    assert records_result == loop_result, "Comment records score differently"
+    columns_time, columns = timed(gyc.comments_to_columns, comments_data)
+    vector_time, vector_result = timed(gyc.score_columns, columns, record_users=record_users)
+    assert loop_result == vector_result, "vectorized result differs from the loop scorer"
+
+    rows = [
+        ("loop (score_comments)", loop_time),
+        ("loop over Comment records", records_time),
+        ("dicts -> columns (comments_to_columns)", columns_time),
+        ("vectorized (score_columns)", vector_time),
+        ("vectorized incl. conversion", columns_time + vector_time),
+    ]
+    print(f"{comments:,} comments, record_users={record_users}")
+    for name, elapsed in rows:
+        print(f"{name:<42} {elapsed:8.3f}s {comments / elapsed:>14,.0f} comments/s")
+
+
+if __name__ == "__main__":
+    main()
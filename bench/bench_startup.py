@@ -0,0 +1,61 @@
+"""Wall time of short CLI invocations, guarding the lazy-import startup path.
+
+Run from the repository root:
+
+    python -m bench.bench_startup --runs=10 --max_seconds=0.5
+
+Exits non-zero when the median `--help` run is slower than --max_seconds or
+when a heavy dependency is imported at module load.
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+SCRIPT = "src/get_yahoo_comments.py"
+HEAVY_MODULES = ("yfinance", "pandas", "numpy", "bs4", "requests")
+
+
+def time_run(args):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def heavy_modules_at_import():
+    """the heavy modules loaded by a bare import of the module"""
+    script = (
+        "import sys; from src import get_yahoo_comments; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True)
+    return [name for name in output.stdout.strip().split(",") if name]
+
+
+@click.command()
+@click.option("--runs", default=10, help="Number of runs per measurement")
+@click.option("--max_seconds", default=0.5, help="Fail when the median --help run is slower")
+def main(runs, max_seconds):
+    baseline = [time_run(["-c", "pass"]) for _ in range(runs)]
+    help_runs = [time_run([SCRIPT, "--help"]) for _ in range(runs)]
+    heavy_import = [time_run(["-c", "import yfinance"]) for _ in range(runs)]
+
+    rows = [
+        ("python -c pass (interpreter)", baseline),
+        (f"{SCRIPT} --help", help_runs),
+        ("import yfinance (avoided cost)", heavy_import),
+    ]
+    for name, samples in rows:
+        print(f"{name:<40} median {statistics.median(samples):6.3f}s  min {min(samples):6.3f}s")
+
+    heavy = heavy_modules_at_import()
+    if heavy:
+        sys.exit(f"heavy modules imported at module load: {', '.join(heavy)}")
+    if statistics.median(help_runs) > max_seconds:
+        sys.exit(f"--help median {statistics.median(help_runs):.3f}s exceeds {max_seconds}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,322 @@
-import requests
-from bs4 import BeautifulSoup as bs
+import asyncio
+import contextlib
+import contextvars
+import functools
+import importlib
 import json
+import multiprocessing
+import os
+import re
 import click
+import sys
+import threading
 import time
-import yfinance as yf
-from datetime import datetime
+from peewee import (
+    EXCLUDED,
+    BooleanField,
+    CharField,
+    CompositeKey,
+    FloatField,
+    IntegerField,
+    Model,
+    SqliteDatabase,
+    TextField,
+    fn,
+)
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
 
-def get_stock_info_as_of_date(symbol, start_date, end_date, info):
-    """retrieves stock info as of specific date provided"""
-    # Load the ticker
-    stock = yf.Ticker(symbol)
+try:
+    # optional, parses comment pages several times faster than the json module
+    from orjson import loads as _loads_json
+except ImportError:
+    _loads_json = json.loads
 
-    result = dict()
-    # Fetch historical data
-    history = stock.history(start=start_date, end=end_date)
 
+class _LazyModule:
+    """stands in for a module and imports it on first attribute access, keeping
+    heavy dependencies off the startup path of short invocations like --help"""
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+np = _LazyModule("numpy")
+pd = _LazyModule("pandas")
+requests = _LazyModule("requests")
+yf = _LazyModule("yfinance")
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PREFETCH = 4
+DEFAULT_SHARD_DAYS = 7
+CONVERSATION_TTL = 7 * 86400  # seconds a cached spotim-config is trusted
+LABEL_FLAGS = {"BULLISH": 1, "BEARISH": 2}
+
+# numpy dtype of the fixed width record kept per comment in the archive files, see write_archive
+ARCHIVE_FIELDS = [("time", "<i8"), ("flags", "u1"), ("user_id", "S64"), ("comment_id", "S64")]
+# directory of the comment archive, only used once set_archive_dir() has been called
+_archive_dir = None
+DEFAULT_PAGE_SIZE = 100
+PAGE_SIZE = DEFAULT_PAGE_SIZE  # comments requested per conversation page, see set_page_size
+_page_size_lock = threading.Lock()
+MAX_USER_WEIGHT = 0  # see set_max_user_weight
+MAX_REPLY_THREADS = 0  # see set_reply_expansion
+FETCH_WORKERS = 0  # see set_fetch_workers
+REPLY_CONCURRENCY = 4
+DEFAULT_MAX_REPLY_THREADS = 200
+# service roots, read on every request so a local stand-in can replace them (see bench/)
+YAHOO_BASE_URL = "https://finance.yahoo.com"
+SPOTIM_BASE_URL = "https://api-2-0.spot.im"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/110.0"
+
+# shared HTTP session settings, see configure_http
+HTTP_SETTINGS = dict(
+    retries=3,  # retries on connection errors, 429 and 5xx responses
+    backoff=0.5,  # exponential backoff factor (seconds), with up to as much random jitter
+    timeout=30,  # seconds per request
+    rate_limit=0,  # max requests per second per host, 0 for no limit
+    pool_size=10,  # keep-alive connections per host
+)
+_http_lock = threading.Lock()
+_http_session = None
+_rate_limiters = dict()
+
+# local cache, only used once open_cache() has been called (see --cache_db)
+cache_db = SqliteDatabase(None)
+
+
+class BaseModel(Model):
+    class Meta:
+        database = cache_db
+
+
+class CachedComment(BaseModel):
+    """the fields of a spot.im comment needed for scoring"""
+
+    conversation_id = CharField()
+    comment_id = CharField()
+    time = IntegerField()
+    user_id = CharField(null=True)
+    labels = CharField(default="")  # comma separated label ids
+    replies_count = IntegerField(default=0)
+
+    class Meta:
+        primary_key = CompositeKey("conversation_id", "comment_id")
+        indexes = ((("conversation_id", "time"), False),)
+
+
+class CrawlState(BaseModel):
+    """every comment of the conversation with covered_from <= time <= newest_time is cached;
+    complete means the crawl reached the very first comment of the conversation"""
+
+    conversation_id = CharField(primary_key=True)
+    newest_time = IntegerField()
+    covered_from = IntegerField()
+    complete = BooleanField(default=False)
+
+
+class ConversationConfig(BaseModel):
+    """the spotim-config scraped from a symbol's community page"""
+
+    symbol = CharField(primary_key=True)
+    config = TextField()  # json
+    fetched_at = IntegerField()
+
+
+class UserStat(BaseModel):
+    """per conversation index of the users behind the cached comments, updated
+    only for comments newly added to the cache so reruns never count twice"""
+
+    conversation_id = CharField()
+    user_id = CharField()
+    comments = IntegerField(default=0)
+    bulls = IntegerField(default=0)
+    bears = IntegerField(default=0)
+    first_seen = IntegerField()
+    last_seen = IntegerField()
+
+    class Meta:
+        primary_key = CompositeKey("conversation_id", "user_id")
+
+
+class DailyResult(BaseModel):
+    """the merged comment and price result of a symbol for one finished day"""
+
+    symbol = CharField()
+    start_date = IntegerField()  # start of the day, as in the result
+    result = TextField()  # json
+    options = TextField(default="")  # json of the _scoring_options the result was scored with
+
+    class Meta:
+        primary_key = CompositeKey("symbol", "start_date")
+
+
+class PriceBar(BaseModel):
+    """a daily OHLCV bar; a row with no prices marks a day without trading"""
+
+    symbol = CharField()
+    date = CharField()  # %Y-%m-%d
+    open = FloatField(null=True)
+    high = FloatField(null=True)
+    low = FloatField(null=True)
+    close = FloatField(null=True)
+    volume = IntegerField(null=True)
+
+    class Meta:
+        primary_key = CompositeKey("symbol", "date")
+
+
+def open_cache(path):
+    """opens (creating if needed) the SQLite cache file and enables caching"""
+    cache_db.init(path, pragmas={"journal_mode": "wal"}, timeout=30)
+    cache_db.create_tables(
+        [CachedComment, CrawlState, ConversationConfig, UserStat, DailyResult, PriceBar]
+    )
+    # columns added after caches were created: reply counts, and the scoring options
+    # of stored results (older results are scored again)
+    for field in (CachedComment.replies_count, DailyResult.options):
+        table = field.model._meta.table_name
+        if field.column_name not in {column.name for column in cache_db.get_columns(table)}:
+            from playhouse.migrate import SqliteMigrator, migrate
+
+            migrate(SqliteMigrator(cache_db).add_column(table, field.column_name, field))
+    return cache_db
+
+
+def close_cache():
+    """closes the cache and disables caching"""
+    if not cache_db.deferred:
+        cache_db.close()
+        cache_db.init(None)
+
+
+LIVE_INFO = {
+    "current_price": "currentPrice",
+    "day_low": "dayLow",
+    "day_high": "dayHigh",
+    "volume": "volume",
+    "previous_close": "previousClose",
+    "shares_short": "sharesShort",
+}
+
+HISTORY_INFO = {
+    "current_price": "Close",
+    "day_low": "Low",
+    "day_high": "High",
+    "volume": "Volume",
+    "previous_close": "Open" # This could be a bug...
+}
+
+
+def _is_live(start_date):
+    """True when start_date (a timestamp) is recent enough for the live quote"""
+    return not start_date or (time.time() - start_date) <= 86400
+
+
+def prefetch_prices(symbols, days):
+    """fills the price cache for every symbol and past day in days (%Y-%m-%d) with
+    a single bulk yf.download, skipping the (symbol, day) cells already cached"""
+    days = [day for day in days if not _is_live(get_start_of_day(day))]
+    if cache_db.deferred or not symbols or not days:
+        return
+
+    cached = set(
+        PriceBar.select(PriceBar.symbol, PriceBar.date)
+        .where(PriceBar.symbol.in_(symbols) & PriceBar.date.in_(days))
+        .tuples()
+    )
+    missing = [(symbol, day) for symbol in symbols for day in days if (symbol, day) not in cached]
+    if not missing:
+        return
+
+    missing_symbols = sorted({symbol for symbol, _ in missing})
+    first_day = min(day for _, day in missing)
+    range_end = datetime.strptime(max(day for _, day in missing), "%Y-%m-%d") + timedelta(days=1)
+    history = yf.download(
+        missing_symbols,
+        start=first_day,
+        end=range_end.strftime("%Y-%m-%d"),
+        group_by="ticker",
+        auto_adjust=True,
+        progress=False,
+    )
+
+    frames = dict()
+    rows = list()
+    for symbol, day in missing:
+        if symbol not in frames:
+            frames[symbol] = _symbol_history(history, symbol)
+        if frames[symbol] is None:
+            # yf.download logs a failed download and returns no rows instead of raising;
+            # caching nothing leaves the days to be downloaded again
+            continue
+        row = dict(symbol=symbol, date=day)
+        try:
+            bar = frames[symbol].loc[day]
+        except KeyError:
+            bar = None
+        if bar is not None:
+            row.update(
+                open=float(bar["Open"]),
+                high=float(bar["High"]),
+                low=float(bar["Low"]),
+                close=float(bar["Close"]),
+                volume=int(bar["Volume"]),
+            )
+        rows.append(row)
+    if rows:
+        with cache_db.atomic():
+            PriceBar.insert_many(rows).on_conflict_replace().execute()
+
+
+def _symbol_history(history, symbol):
+    """the rows of a yf.download frame holding prices for symbol, or None when the
+    download returned none for it; only then does a missing day mean no trading"""
+    try:
+        frame = history[symbol] if history.columns.nlevels > 1 else history
+    except KeyError:
+        return None
+    frame = frame.dropna(how="all")
+    return frame if len(frame) else None
+
+
+def _get_cached_stock_info(symbol, day, info):
+    bar = PriceBar.get_or_none((PriceBar.symbol == symbol) & (PriceBar.date == day))
+    if bar is None:
+        prefetch_prices([symbol], [day])
+        bar = PriceBar.get_or_none((PriceBar.symbol == symbol) & (PriceBar.date == day))
+    if bar is None or bar.close is None:
+        return {"error": f"No data found for {symbol} on {day}"}
+    return {key: round(getattr(bar, info[key].lower()), 2) for key in info.keys()}
+
+
+def get_stock_info_as_of_date(symbol, start_date, end_date, info, history=None):
+    """retrieves stock info as of specific date provided; pass a pre-fetched
+    history frame to avoid a download per day. With the cache enabled the
+    price cache is used instead (see prefetch_prices)"""
+    if history is None and not cache_db.deferred:
+        return _get_cached_stock_info(symbol, start_date, info)
+
+    if history is None:
+        # Load the ticker
+        stock = yf.Ticker(symbol)
+
+        # Fetch historical data
+        history = stock.history(start=start_date, end=end_date)
+
+    result = dict()
     # Extract data for the given date
     if start_date in history.index:
         row = history.loc[start_date]
@@ -27,41 +329,127 @@ def get_stock_info_as_of_date(symbol, start_date, end_date, info):
 
 def get_stock_info(symbol, start_date=False, end_date=False):
     """uses the yahoo finance API to retrieve the current market price and previous close"""
+    with _stage("get_stock_info"):
+        return _get_stock_info(symbol, start_date, end_date)
 
-    stock = yf.Ticker(symbol)
-    info = {
-        "current_price": "currentPrice",
-        "day_low": "dayLow",
-        "day_high": "dayHigh",
-        "volume": "volume",
-        "previous_close": "previousClose",
-        "shares_short": "sharesShort",
-    }
+
+def _get_stock_info(symbol, start_date, end_date):
     result = dict()
-    if (time.time() - start_date) <= 86400:
-        
-        for key in info.keys():
-            result[key] = stock.info.get(info[key])
+    if _is_live(start_date):
+        stock = yf.Ticker(symbol)
+        for key in LIVE_INFO.keys():
+            result[key] = stock.info.get(LIVE_INFO[key])
     else:
-        info = {
-            "current_price": "Close",
-            "day_low": "Low",
-            "day_high": "High",
-            "volume": "Volume",
-            "previous_close": "Open" # This could be a bug...
-        }
-        
         start_date = datetime.fromtimestamp(start_date).strftime("%Y-%m-%d")
         end_date = datetime.fromtimestamp(int(end_date) + 86401).strftime("%Y-%m-%d")
 
-        result = get_stock_info_as_of_date(symbol, start_date, end_date, info)
+        result = get_stock_info_as_of_date(symbol, start_date, end_date, HISTORY_INFO)
     return result
 
 
-def score_comments(comments_data, record_users=False):
-    "Takes the data from conversation API and scores it returning a result object"
+def get_stock_info_by_day(symbol, days):
+    """retrieves stock info for each day in days (%Y-%m-%d strings, ascending) with a
+    single history download (or price cache fill) for the whole range; today falls
+    back to the live quote"""
+    with _stage("get_stock_info"):
+        return _get_stock_info_by_day(symbol, days)
 
-    result = dict(
+
+def _get_stock_info_by_day(symbol, days):
+    prefetch_prices([symbol], days)
+
+    result = dict()
+    history = None
+    for day in days:
+        day_start = get_start_of_day(day)
+        if _is_live(day_start):
+            result[day] = get_stock_info(symbol, start_date=day_start, end_date=get_end_of_day(day))
+            continue
+        if history is None and cache_db.deferred:
+            range_end = datetime.strptime(days[-1], "%Y-%m-%d") + timedelta(days=1)
+            history = yf.Ticker(symbol).history(
+                start=days[0], end=range_end.strftime("%Y-%m-%d")
+            )
+        result[day] = get_stock_info_as_of_date(symbol, day, None, HISTORY_INFO, history=history)
+    return result
+
+
+# the label ids of each combination of LABEL_FLAGS bits
+_FLAG_LABELS = {
+    flags: tuple(label for label, bit in LABEL_FLAGS.items() if flags & bit)
+    for flags in range(max(LABEL_FLAGS.values()) * 2)
+}
+
+
+class Comment:
+    """a spot.im comment cut down at parse time to what scoring and storage read,
+    with its labels packed into LABEL_FLAGS bits. Item access (comment["time"],
+    comment.get("user_id")) mirrors the raw dicts, which are still accepted
+    wherever comments are"""
+
+    __slots__ = ("id", "time", "user_id", "flags", "replies_count")
+
+    def __init__(self, id, time, user_id=None, flags=0, replies_count=0):
+        self.id = id
+        self.time = time
+        self.user_id = user_id
+        self.flags = flags
+        self.replies_count = replies_count
+
+    @classmethod
+    def from_dict(cls, comment):
+        return cls(
+            comment["id"],
+            comment["time"],
+            _intern_user_id(comment.get("user_id")),
+            _label_flags(comment),
+            comment.get("replies_count", 0),
+        )
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def _fields(self):
+        return (self.id, self.time, self.user_id, self.flags, self.replies_count)
+
+    def __eq__(self, other):
+        return isinstance(other, Comment) and self._fields() == other._fields()
+
+    def __repr__(self):
+        return "Comment(id={!r}, time={!r}, user_id={!r}, flags={!r}, replies_count={!r})".format(
+            *self._fields()
+        )
+
+
+def _intern_user_id(user_id):
+    """one string object per user: repeat posters share it, and the user sets of
+    _finish_score hash far fewer objects"""
+    return sys.intern(user_id) if type(user_id) is str else user_id
+
+
+def _comment_labels(comment):
+    if type(comment) is Comment:
+        return _FLAG_LABELS[comment.flags]
+    try:
+        return comment["additional_data"]["labels"]["ids"]
+    except:
+        return list()
+
+
+def set_max_user_weight(weight):
+    """caps how many bullish (and bearish) comments of a single user count towards
+    the weighted_score of a result; 0 leaves weighted_score out"""
+    global MAX_USER_WEIGHT
+    MAX_USER_WEIGHT = max(0, weight)
+
+
+def _new_score():
+    return dict(
         bears=0,
         bear_users=list(),
         bulls=0,
@@ -70,36 +458,64 @@ def score_comments(comments_data, record_users=False):
         score=0,
         oldest_comment_ts=None,
         newest_comment_ts=None,
+        # the users seen, and those with a bullish and a bearish comment, plus
+        # user_id -> [bulls, bears] when MAX_USER_WEIGHT is set; all O(users) in memory
+        # and reduced to the unique user counts by _finish_score
+        users=set(),
+        bullish_users=set(),
+        bearish_users=set(),
+        user_counts=dict(),
     )
-    for comment in comments_data:
-        try:
-            labels = comment["additional_data"]["labels"]["ids"]
-        except:
-            labels = list()
-
-        if "BEARISH" in labels:
-            if record_users:
-                result['bear_users'].append(comment['user_id'])
-            result["bears"] = result["bears"] + 1
-        if "BULLISH" in labels:
-            if record_users:
-                result['bull_users'].append(comment['user_id'])
-            result["bulls"] = result["bulls"] + 1
-        if "BEARISH" not in labels and "BULLISH" not in labels:
-            result["neutral"] = result["neutral"] + 1
-
-        if (
-            not result["oldest_comment_ts"]
-            or comment["time"] < result["oldest_comment_ts"]
-        ):
-            result["oldest_comment_ts"] = comment["time"]
 
-        if (
-            not result["newest_comment_ts"]
-            or comment["time"] > result["newest_comment_ts"]
-        ):
-            result["newest_comment_ts"] = comment["time"]
 
+def _add_to_score(result, comment, record_users=False):
+    """adds a single comment (a Comment or a raw dict) to a running score result"""
+    if type(comment) is Comment:
+        labels = _FLAG_LABELS[comment.flags]
+        user_id = comment.user_id
+        comment_time = comment.time
+    else:
+        labels = _comment_labels(comment)
+        user_id = comment.get("user_id")
+        comment_time = comment["time"]
+    bullish = "BULLISH" in labels
+    bearish = "BEARISH" in labels
+
+    if bearish:
+        if record_users:
+            result['bear_users'].append(user_id)
+        result["bearish_users"].add(user_id)
+        result["bears"] = result["bears"] + 1
+    if bullish:
+        if record_users:
+            result['bull_users'].append(user_id)
+        result["bullish_users"].add(user_id)
+        result["bulls"] = result["bulls"] + 1
+    if not bearish and not bullish:
+        result["neutral"] = result["neutral"] + 1
+    result["users"].add(user_id)
+    if MAX_USER_WEIGHT and (bullish or bearish):
+        counts = result["user_counts"].get(user_id)
+        if counts is None:
+            counts = result["user_counts"][user_id] = [0, 0]
+        counts[0] += bullish
+        counts[1] += bearish
+
+    if (
+        not result["oldest_comment_ts"]
+        or comment_time < result["oldest_comment_ts"]
+    ):
+        result["oldest_comment_ts"] = comment_time
+
+    if (
+        not result["newest_comment_ts"]
+        or comment_time > result["newest_comment_ts"]
+    ):
+        result["newest_comment_ts"] = comment_time
+
+
+def _finish_score(result):
+    """formats the timestamps and computes the score of a running score result"""
     try:
         result["oldest_comment_ts"] = datetime.fromtimestamp(
             result["oldest_comment_ts"]
@@ -112,75 +528,1318 @@ def score_comments(comments_data, record_users=False):
 
     result["score"] = result["bulls"] - result["bears"]
 
+    result["unique_users"] = _count_users(result.pop("users"))
+    result["unique_bulls"] = _count_users(result.pop("bullish_users"))
+    result["unique_bears"] = _count_users(result.pop("bearish_users"))
+    user_counts = result.pop("user_counts")
+    if MAX_USER_WEIGHT:
+        result["weighted_score"] = sum(
+            min(bulls, MAX_USER_WEIGHT) - min(bears, MAX_USER_WEIGHT)
+            for user_id, (bulls, bears) in user_counts.items()
+            if user_id
+        )
+
     return result
 
 
-def get_conversation_info(symbol):
-    url = f"https://finance.yahoo.com/quote/{symbol}/community"
-    response = requests.get(
-        url,
-        headers={
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/110.0"
-        },
+def _count_users(users):
+    """the number of non-empty user ids in a set of them"""
+    return len(users) - (None in users) - ("" in users)
+
+
+def score_comments(comments_data, record_users=False):
+    "Takes the data from conversation API and scores it returning a result object"
+
+    result = _new_score()
+    with _stage("score_comments"):
+        for comment in comments_data:
+            _add_to_score(result, comment, record_users=record_users)
+
+    return _finish_score(result)
+
+
+def comments_to_columns(comments_data):
+    """converts comments into numpy columns: time (int64), user_id (object),
+    user_code (int64, see _score_user_columns), bullish and bearish (bool),
+    walking the comments once"""
+    times = list()
+    user_ids = list()
+    bullish = list()
+    bearish = list()
+    for comment in comments_data:
+        labels = _comment_labels(comment)
+        times.append(comment["time"])
+        user_ids.append(comment.get("user_id"))
+        bullish.append("BULLISH" in labels)
+        bearish.append("BEARISH" in labels)
+    user_ids = np.array(user_ids, dtype=object)
+    # hashed in C, where np.unique would sort the Python objects; None codes to -1
+    user_codes, users = pd.factorize(user_ids)
+    user_codes[np.isin(user_codes, np.flatnonzero(users == ""))] = -1
+    return dict(
+        time=np.array(times, dtype=np.int64),
+        user_id=user_ids,
+        user_code=user_codes.astype(np.int64),
+        bullish=np.array(bullish, dtype=bool),
+        bearish=np.array(bearish, dtype=bool),
+    )
+
+
+def score_columns(columns, record_users=False):
+    """vectorized scoring of comment columns (see comments_to_columns), returning the
+    same result object as score_comments"""
+    bullish = columns["bullish"]
+    bearish = columns["bearish"]
+
+    result = _new_score()
+    result["bulls"] = int(np.count_nonzero(bullish))
+    result["bears"] = int(np.count_nonzero(bearish))
+    result["neutral"] = int(np.count_nonzero(~(bullish | bearish)))
+    if record_users:
+        result["bull_users"] = columns["user_id"][bullish].tolist()
+        result["bear_users"] = columns["user_id"][bearish].tolist()
+    if len(columns["time"]):
+        result["oldest_comment_ts"] = int(columns["time"].min())
+        result["newest_comment_ts"] = int(columns["time"].max())
+
+    result = _finish_score(result)
+    result.update(_score_user_columns(columns))
+    return result
+
+
+def _score_user_columns(columns):
+    """the unique user counts (and weighted_score) of _finish_score, computed on the
+    user_code column: a dense index of each comment's user, -1 without a user"""
+    user_codes = columns["user_code"]
+    present = user_codes >= 0
+    user_codes = user_codes[present]
+    user_comments = np.bincount(user_codes)
+    user_bulls = np.bincount(user_codes, weights=columns["bullish"][present], minlength=len(user_comments))
+    user_bears = np.bincount(user_codes, weights=columns["bearish"][present], minlength=len(user_comments))
+
+    result = dict(
+        unique_users=int(np.count_nonzero(user_comments)),
+        unique_bulls=int(np.count_nonzero(user_bulls)),
+        unique_bears=int(np.count_nonzero(user_bears)),
+    )
+    if MAX_USER_WEIGHT:
+        result["weighted_score"] = int(
+            np.minimum(user_bulls, MAX_USER_WEIGHT).sum() - np.minimum(user_bears, MAX_USER_WEIGHT).sum()
+        )
+    return result
+
+
+def score_comments_vectorized(comments_data, record_users=False):
+    "score_comments over numpy columns; much faster once the comments are columnar"
+    return score_columns(comments_to_columns(comments_data), record_users=record_users)
+
+
+def _label_flags(comment):
+    if type(comment) is Comment:
+        return comment.flags
+    flags = 0
+    for label in _comment_labels(comment):
+        flags |= LABEL_FLAGS.get(label, 0)
+    return flags
+
+
+def set_archive_dir(path):
+    """enables writing complete days of comments to the archive under path ("" disables)"""
+    global _archive_dir
+    _archive_dir = path or None
+
+
+def archive_path(archive_dir, symbol, day):
+    return os.path.join(archive_dir, symbol, f"{day}.npy")
+
+
+def comments_to_records(comments):
+    """packs comments into an ARCHIVE_FIELDS record array"""
+    return np.array(
+        [
+            (
+                comment["time"],
+                _label_flags(comment),
+                (comment.get("user_id") or "").encode(),
+                (comment.get("id") or "").encode(),
+            )
+            for comment in comments
+        ],
+        dtype=np.dtype(ARCHIVE_FIELDS),
+    )
+
+
+def write_archive(archive_dir, symbol, day, comments):
+    """writes the comments of one symbol-day as a numpy record file, atomically"""
+    path = archive_path(archive_dir, symbol, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, comments_to_records(comments))
+    os.replace(temp_path, path)
+    return path
+
+
+def load_archive(archive_dir, symbol, day):
+    """memory-maps the records of one symbol-day, or returns None if not archived"""
+    path = archive_path(archive_dir, symbol, day)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def records_to_columns(records, record_users=False):
+    """turns archive records into the columns expected by score_columns;
+    user ids are only decoded when record_users is set"""
+    flags = records["flags"]
+    user_ids = records["user_id"]
+    # fixed width bytes sort in C, so the user codes come from np.unique here
+    users, user_codes = np.unique(user_ids, return_inverse=True)
+    if len(users) and users[0] == b"":
+        user_codes = user_codes - 1
+    if record_users:
+        user_ids = np.char.decode(user_ids).astype(object)
+    return dict(
+        time=np.asarray(records["time"]),
+        user_id=user_ids,
+        user_code=user_codes.reshape(-1).astype(np.int64),
+        bullish=(flags & LABEL_FLAGS["BULLISH"]) > 0,
+        bearish=(flags & LABEL_FLAGS["BEARISH"]) > 0,
+    )
+
+
+def archive_days(archive_dir, symbol, comments, start_date, end_date):
+    """writes one archive file per day of the date range that is already over;
+    the comments must cover the whole range"""
+    buckets = {day: list() for day in get_days(start_date, end_date)}
+    for comment in comments:
+        day = datetime.fromtimestamp(comment["time"]).strftime("%Y-%m-%d")
+        if day in buckets:
+            buckets[day].append(comment)
+    for day, day_comments in buckets.items():
+        if get_start_of_day(day) >= start_date and get_end_of_day(day) <= min(end_date, time.time()):
+            write_archive(archive_dir, symbol, day, day_comments)
+
+
+def _archived(comments, symbol, start_date, end_date):
+    """passes the comment stream through, archiving the complete days once it is consumed"""
+    if not _archive_dir:
+        yield from comments
+        return
+    kept = list()
+    for comment in comments:
+        kept.append(comment)
+        yield comment
+    archive_days(_archive_dir, symbol, kept, start_date, end_date)
+
+
+def rescore_archive(archive_dir, symbol, days, record_users=False):
+    """scores archived days without any network access; returns day -> result,
+    with None for days that are not archived"""
+    result = dict()
+    for day in days:
+        records = load_archive(archive_dir, symbol, day)
+        result[day] = None
+        if records is not None:
+            result[day] = score_columns(records_to_columns(records, record_users), record_users)
+    return result
+
+
+def get_days(start_date, end_date):
+    """lists the calendar days (%Y-%m-%d) touched by the start/end timestamps"""
+    day = datetime.fromtimestamp(start_date).date()
+    last_day = datetime.fromtimestamp(end_date).date()
+    days = list()
+    while day <= last_day:
+        days.append(day.strftime("%Y-%m-%d"))
+        day = day + timedelta(days=1)
+    return days
+
+
+def score_comments_by_day(comments_data, start_date, end_date, record_users=False):
+    """scores the comments in a single pass, bucketing them by calendar day;
+    returns an ordered dict of day -> result object (days without comments included)"""
+
+    buckets = {day: _new_score() for day in get_days(start_date, end_date)}
+    with _stage("score_comments"):
+        for comment in comments_data:
+            day = datetime.fromtimestamp(comment["time"]).strftime("%Y-%m-%d")
+            if day in buckets:
+                _add_to_score(buckets[day], comment, record_users=record_users)
+
+    return {day: _finish_score(result) for day, result in buckets.items()}
+
+
+class Metrics:
+    """wall time per stage and HTTP counters of one profiled symbol run (see --profile).
+    Stage times are exclusive: the pages fetched while score_comments pulls the
+    comment stream are counted under _get_comments_block only"""
+
+    COUNTERS = (
+        "requests",
+        "bytes_downloaded",
+        "pages_fetched",
+        "retries",
+        "pages_scanned",
+        "pages_skipped",
+        "reply_threads",
+        "reply_threads_skipped",
+    )
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = dict()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages.setdefault(stage, list()).append(seconds)
+
+    def count(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.counters[name] += value
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        # per thread stack of the time spent in stages nested in the open ones
+        stack = self.local.__dict__.setdefault("stack", list())
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self.add(name, elapsed - nested)
+
+    def as_dict(self):
+        with self.lock:
+            stages = {
+                name: {
+                    "calls": len(calls),
+                    "seconds": round(sum(calls), 6),
+                    "call_seconds": [round(seconds, 6) for seconds in calls],
+                }
+                for name, calls in self.stages.items()
+            }
+            return dict(
+                wall_seconds=round(time.perf_counter() - self.started, 6),
+                stages=stages,
+                **self.counters,
+            )
+
+
+# the Metrics of the symbol run in progress, None unless profiling
+_metrics = contextvars.ContextVar("metrics", default=None)
+
+
+def _stage(name):
+    metrics = _metrics.get()
+    return metrics.stage(name) if metrics else contextlib.nullcontext()
+
+
+def _count(**counts):
+    metrics = _metrics.get()
+    if metrics:
+        metrics.count(**counts)
+
+
+def _attach_metrics(result, metrics):
+    if isinstance(result, list):
+        result = result[0] if result else None
+    if isinstance(result, dict):
+        result["metrics"] = metrics.as_dict()
+
+
+def profiled(func, *args, **kwargs):
+    """calls func while collecting Metrics and attaches them as "metrics" to its
+    result; when func returns one result per day only the first one carries them"""
+    metrics = Metrics()
+    token = _metrics.set(metrics)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        _metrics.reset(token)
+    _attach_metrics(result, metrics)
+    return result
+
+
+async def async_profiled(func, *args, **kwargs):
+    """profiled for coroutine functions"""
+    metrics = Metrics()
+    token = _metrics.set(metrics)
+    try:
+        result = await func(*args, **kwargs)
+    finally:
+        _metrics.reset(token)
+    _attach_metrics(result, metrics)
+    return result
+
+
+def _prometheus_labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def metrics_to_prometheus(results):
+    """renders the metrics attached to results in the Prometheus text exposition format"""
+    profiled_results = [result for result in results if "metrics" in result]
+    lines = list()
+
+    def family(name, kind, help_text, samples):
+        lines.append(f"# HELP yahoo_comments_{name} {help_text}")
+        lines.append(f"# TYPE yahoo_comments_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"yahoo_comments_{name}{{{labels}}} {value}")
+
+    def stage_samples(field):
+        for result in profiled_results:
+            for stage, values in result["metrics"]["stages"].items():
+                yield _prometheus_labels(symbol=result["symbol"], stage=stage), values[field]
+
+    family("stage_seconds", "counter", "Wall time spent per stage.", stage_samples("seconds"))
+    family("stage_calls", "counter", "Calls per stage.", stage_samples("calls"))
+    family(
+        "wall_seconds",
+        "gauge",
+        "Wall time of the symbol run.",
+        [
+            (_prometheus_labels(symbol=result["symbol"]), result["metrics"]["wall_seconds"])
+            for result in profiled_results
+        ],
+    )
+    for counter in Metrics.COUNTERS:
+        family(
+            f"{counter}_total",
+            "counter",
+            f"{counter.replace('_', ' ').capitalize()} of the symbol run.",
+            [
+                (_prometheus_labels(symbol=result["symbol"]), result["metrics"][counter])
+                for result in profiled_results
+            ],
+        )
+    return "\n".join(lines) + "\n"
+
+
+class _RateLimiter:
+    """spaces calls at least 1 / rate seconds apart across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def configure_http(**settings):
+    """updates HTTP_SETTINGS (retries, backoff, timeout, rate_limit, pool_size);
+    the shared session is rebuilt on the next request"""
+    global _http_session
+    unknown = set(settings) - set(HTTP_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown HTTP settings: {', '.join(sorted(unknown))}")
+    with _http_lock:
+        HTTP_SETTINGS.update(settings)
+        _http_session = None
+        _rate_limiters.clear()
+
+
+def _get_session():
+    global _http_session
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    with _http_lock:
+        if _http_session is None:
+            retry = Retry(
+                total=HTTP_SETTINGS["retries"],
+                backoff_factor=HTTP_SETTINGS["backoff"],
+                backoff_jitter=HTTP_SETTINGS["backoff"],
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,  # conversation/read is a POST but safe to repeat
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                max_retries=retry,
+                pool_connections=HTTP_SETTINGS["pool_size"],
+                pool_maxsize=HTTP_SETTINGS["pool_size"],
+            )
+            session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def _get_rate_limiter(host):
+    with _http_lock:
+        if not HTTP_SETTINGS["rate_limit"]:
+            return None
+        if host not in _rate_limiters:
+            _rate_limiters[host] = _RateLimiter(HTTP_SETTINGS["rate_limit"])
+        return _rate_limiters[host]
+
+
+def _http_request(method, url, **kwargs):
+    """sends a request through the shared keep-alive session, honouring the per-host
+    rate limit; raises requests.HTTPError once retries are exhausted"""
+    rate_limiter = _get_rate_limiter(urlparse(url).netloc)
+    if rate_limiter:
+        rate_limiter.wait()
+    kwargs.setdefault("timeout", HTTP_SETTINGS["timeout"])
+    response = _get_session().request(method, url, **kwargs)
+    retries = getattr(response.raw, "retries", None)
+    _count(
+        requests=1,
+        bytes_downloaded=len(response.content),
+        retries=len(retries.history) if retries else 0,
     )
-    soup = bs(response.text, features="html.parser")
-    data = json.loads(soup.select_one("#spotim-config").get_text(strip=True))["config"]
+    response.raise_for_status()
+    return response
+
+
+def _http_get(url, **kwargs):
+    return _http_request("GET", url, **kwargs)
+
+
+def _http_post(url, **kwargs):
+    return _http_request("POST", url, **kwargs)
+
+
+_SPOTIM_CONFIG_RE = re.compile(
+    r"""<script[^>]*\bid=["']spotim-config["'][^>]*>(.*?)</script>""", re.DOTALL
+)
+
+
+def get_conversation_info(symbol):
+    """scrapes the spotim-config (spotId, uuid, ...) from the symbol's community page,
+    storing it in the cache when caching is enabled"""
+    with _stage("get_conversation_info"):
+        return _get_conversation_info(symbol)
+
+
+def _get_conversation_info(symbol):
+    url = f"{YAHOO_BASE_URL}/quote/{symbol}/community"
+    response = _http_get(url)
+
+    match = _SPOTIM_CONFIG_RE.search(response.text)
+    if match:
+        config_text = match.group(1).strip()
+    else:
+        # slow path for markup the regex does not expect
+        from bs4 import BeautifulSoup as bs
+
+        config_tag = bs(response.text, features="html.parser").select_one("#spotim-config")
+        if config_tag is None:
+            raise ValueError(f"No spotim-config found on the community page of {symbol}")
+        config_text = config_tag.get_text(strip=True)
+    data = json.loads(config_text)["config"]
+
+    if not cache_db.deferred:
+        ConversationConfig.replace(
+            symbol=symbol, config=json.dumps(data), fetched_at=int(time.time())
+        ).execute()
 
     return data
 
 
+def get_cached_conversation_info(symbol):
+    """returns the cached spotim-config of symbol, or None when caching is disabled
+    or it is missing or older than CONVERSATION_TTL"""
+    if cache_db.deferred:
+        return None
+    row = ConversationConfig.get_or_none(
+        (ConversationConfig.symbol == symbol)
+        & (ConversationConfig.fetched_at > time.time() - CONVERSATION_TTL)
+    )
+    return json.loads(row.config) if row else None
+
+
+def invalidate_conversation_info(symbol):
+    if not cache_db.deferred:
+        ConversationConfig.delete().where(ConversationConfig.symbol == symbol).execute()
+
+
+def _with_conversation(symbol, func):
+    """calls func with the conversation info of symbol, preferring the cached config;
+    if the comment API rejects a cached config it is dropped and func is retried
+    once with a freshly scraped one"""
+    conversation_info = get_cached_conversation_info(symbol)
+    if conversation_info is not None:
+        try:
+            return func(conversation_info)
+        except (requests.HTTPError, ValueError):
+            invalidate_conversation_info(symbol)
+    return func(get_conversation_info(symbol))
+
+
+def _conversation_id(conversation_info):
+    return conversation_info["spotId"] + conversation_info["uuid"].replace("_", "$")
+
+
 def _get_comments_block(conversation_info, offset):
-    url = "https://api-2-0.spot.im/v1.0.0/conversation/read"
+    count = PAGE_SIZE
+    with _stage("_get_comments_block"):
+        conversation_data = _read_conversation(conversation_info, offset, count)
+    _count(pages_fetched=1)
+    _fit_page_size(count, conversation_data)
+    return conversation_data
+
+
+def _fit_page_size(count, conversation_data):
+    """lowers PAGE_SIZE to the size of a top-level page the API capped below count,
+    keeping speculative offsets (seek, prefetch, shards) aligned to its pages"""
+    global PAGE_SIZE
+    served = len(conversation_data["comments"])
+    if count > DEFAULT_PAGE_SIZE and conversation_data["has_next"] and DEFAULT_PAGE_SIZE <= served < count:
+        # pages fetched on pool threads may report the cap at once
+        with _page_size_lock:
+            PAGE_SIZE = min(PAGE_SIZE, served)
+
+
+def set_page_size(size):
+    """sets the comments requested per conversation page; a size above what the
+    API serves falls back to the page size it actually returns"""
+    global PAGE_SIZE
+    PAGE_SIZE = max(1, size)
+
+
+def _project_comment(comment):
+    """the Comment of a parsed spot.im comment; content blocks, replies, ranks
+    and the rest are dropped as soon as the page is parsed"""
+    return Comment.from_dict(comment)
+
+
+def _get_replies_block(conversation_info, parent_id, offset):
+    with _stage("_get_replies_block"):
+        conversation_data = _read_conversation(conversation_info, offset, PAGE_SIZE, parent_id=parent_id)
+    _count(pages_fetched=1)
+    return conversation_data
+
+
+def _read_conversation(conversation_info, offset, count, parent_id=None):
+    """reads a page of count comments of the conversation, or of the replies to parent_id"""
+    url = f"{SPOTIM_BASE_URL}/v1.0.0/conversation/read"
 
     headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/110.0",
         "Content-Type": "application/json",
         "x-spot-id": conversation_info["spotId"],
         "x-post-id": conversation_info["uuid"].replace("_", "$"),
     }
 
-    payload = json.dumps(
-        {
-            "conversation_id": conversation_info["spotId"]
-            + conversation_info["uuid"].replace("_", "$"),
-            "count": 100,
-            "offset": offset,
+    payload = {
+        "conversation_id": _conversation_id(conversation_info),
+        "count": count,
+        "offset": offset,
+    }
+    if parent_id:
+        payload["parent_id"] = parent_id
+    payload = json.dumps(payload)
+
+    response = _http_post(url, headers=headers, data=payload)
+    conversation_data = _loads_json(response.content)
+    if "conversation" not in conversation_data:
+        raise ValueError(
+            f"No conversation in spot.im response for {_conversation_id(conversation_info)}: "
+            f"{str(conversation_data)[:200]}"
+        )
+
+    conversation = conversation_data["conversation"]
+    comments = [_project_comment(comment) for comment in conversation.get("comments") or ()]
+    return {"comments": comments, "has_next": bool(conversation.get("has_next"))}
+
+
+def _iter_pages(conversation_info, offset, page=None):
+    """yields the non-empty comment pages of the conversation, newest first, starting
+    at offset; page is the page at offset when it was already fetched (see _seek)"""
+    while True:
+        conversation_data = page
+        if conversation_data is None:
+            conversation_data = _get_comments_block(conversation_info, offset)
+        page = None
+        if not conversation_data["comments"]:
+            return
+        yield conversation_data
+        if not conversation_data["has_next"]:
+            return
+        offset = offset + len(conversation_data["comments"])
+
+
+def _save_comments(conversation_id, comments):
+    rows = [
+        dict(
+            conversation_id=conversation_id,
+            comment_id=comment["id"],
+            time=comment["time"],
+            user_id=comment.get("user_id"),
+            labels=",".join(_comment_labels(comment)),
+            replies_count=comment.get("replies_count", 0),
+        )
+        for comment in comments
+    ]
+    # take the write lock up front: a read transaction upgraded to a write fails
+    # with "database is locked" when another thread wrote in between
+    with cache_db.atomic("IMMEDIATE"):
+        cached_ids = {
+            row.comment_id
+            for row in CachedComment.select(CachedComment.comment_id).where(
+                (CachedComment.conversation_id == conversation_id)
+                & CachedComment.comment_id.in_([row["comment_id"] for row in rows])
+            )
         }
+        # only the reply count of a comment changes once it is posted
+        CachedComment.insert_many(rows).on_conflict(
+            conflict_target=[CachedComment.conversation_id, CachedComment.comment_id],
+            update={CachedComment.replies_count: EXCLUDED.replies_count},
+        ).execute()
+        _update_user_stats(
+            conversation_id, [row for row in rows if row["comment_id"] not in cached_ids]
+        )
+
+
+def _update_user_stats(conversation_id, rows):
+    """adds newly cached comment rows to the UserStat index"""
+    stats = dict()
+    for row in rows:
+        if not row["user_id"]:
+            continue
+        stat = stats.get(row["user_id"])
+        if stat is None:
+            stat = stats[row["user_id"]] = dict(
+                conversation_id=conversation_id,
+                user_id=row["user_id"],
+                comments=0,
+                bulls=0,
+                bears=0,
+                first_seen=row["time"],
+                last_seen=row["time"],
+            )
+        stat["comments"] += 1
+        stat["bulls"] += "BULLISH" in row["labels"]
+        stat["bears"] += "BEARISH" in row["labels"]
+        stat["first_seen"] = min(stat["first_seen"], row["time"])
+        stat["last_seen"] = max(stat["last_seen"], row["time"])
+    if not stats:
+        return
+    UserStat.insert_many(list(stats.values())).on_conflict(
+        conflict_target=[UserStat.conversation_id, UserStat.user_id],
+        update={
+            UserStat.comments: UserStat.comments + EXCLUDED.comments,
+            UserStat.bulls: UserStat.bulls + EXCLUDED.bulls,
+            UserStat.bears: UserStat.bears + EXCLUDED.bears,
+            UserStat.first_seen: fn.MIN(UserStat.first_seen, EXCLUDED.first_seen),
+            UserStat.last_seen: fn.MAX(UserStat.last_seen, EXCLUDED.last_seen),
+        },
+    ).execute()
+
+
+def top_users(symbol, limit=20):
+    """the most active users of symbol's conversation according to the UserStat
+    index; needs the cache and the cached spotim-config of the symbol"""
+    config = ConversationConfig.get_or_none(ConversationConfig.symbol == symbol)
+    if config is None:
+        raise ValueError(f"No cached conversation for {symbol}")
+    query = (
+        UserStat.select()
+        .where(UserStat.conversation_id == _conversation_id(json.loads(config.config)))
+        .order_by(UserStat.comments.desc(), UserStat.user_id)
+        .limit(limit)
     )
+    return [
+        dict(
+            symbol=symbol,
+            user_id=stat.user_id,
+            comments=stat.comments,
+            bulls=stat.bulls,
+            bears=stat.bears,
+            first_seen=stat.first_seen,
+            last_seen=stat.last_seen,
+        )
+        for stat in query
+    ]
 
-    response = requests.post(url, headers=headers, data=payload)
-    conversation_data = response.json()
 
-    return conversation_data["conversation"]
+class UserGraph:
+    """user x symbol comment counts as a CSR matrix in numpy arrays: the symbols
+    user_ids[i] posted on are symbols[indices[indptr[i]:indptr[i + 1]]], with
+    data holding the comment counts"""
 
+    def __init__(self, user_ids, symbols, indptr, indices, data):
+        self.user_ids = user_ids
+        self.symbols = symbols
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
 
-def get_comment_data(
-    conversation_info, start_date, end_date, offset, comments_data=list()
-):
-    conversation_data = _get_comments_block(conversation_info, offset)
-    len_comments = len(conversation_data["comments"])
-    i = 0
-    for comment in conversation_data["comments"]:
-        i += 1
-        if comment["time"] >= end_date:
-            pass
-        if comment["time"] <= start_date:
-            pass
-        if comment["time"] >= start_date and comment["time"] <= end_date:
-            comments_data.append(comment)
-        if i == len_comments:
-            if comment["time"] <= start_date:
-                break
-            if conversation_data["has_next"]:
-                offset = offset + i
-                conversation_data = get_comment_data(
-                    conversation_info,
-                    start_date,
-                    end_date,
-                    offset,
-                    comments_data=comments_data,
+    def symbol_counts(self):
+        """the number of distinct symbols of each user"""
+        return np.diff(self.indptr)
+
+    def cross_posters(self, limit=20, min_symbols=2):
+        """the users posting on the most symbols (ties broken by comment count)"""
+        symbol_counts = self.symbol_counts()
+        comments = np.add.reduceat(self.data, self.indptr[:-1]) if len(self.data) else self.data
+        candidates = np.flatnonzero(symbol_counts >= min_symbols)
+        order = np.lexsort((-comments[candidates], -symbol_counts[candidates]))[:limit]
+        result = list()
+        for row in candidates[order]:
+            row_slice = slice(self.indptr[row], self.indptr[row + 1])
+            result.append(
+                dict(
+                    user_id=self.user_ids[row],
+                    symbols=[self.symbols[i] for i in self.indices[row_slice]],
+                    comments=int(comments[row]),
                 )
-    return comments_data
+            )
+        return result
+
+    def crowd_overlap(self, top=5, chunk_rows=10_000):
+        """per symbol: its users, how many of them also post on another symbol and
+        the symbols sharing the most users with it. Only users with several symbols
+        add to the symbol x symbol co-occurrence, which is built from dense chunks
+        of their rows to bound memory"""
+        symbol_count = len(self.symbols)
+        users_per_symbol = np.bincount(self.indices, minlength=symbol_count)
+        shared = np.zeros((symbol_count, symbol_count), dtype=np.int64)
+        multi = np.flatnonzero(self.symbol_counts() > 1)
+        for start in range(0, len(multi), chunk_rows):
+            rows = multi[start:start + chunk_rows]
+            lengths = self.indptr[rows + 1] - self.indptr[rows]
+            # positions in indices of every entry of the chunk's rows
+            row_starts = np.repeat(self.indptr[rows], lengths)
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            dense = np.zeros((len(rows), symbol_count), dtype=np.float32)
+            dense[np.repeat(np.arange(len(rows)), lengths), self.indices[row_starts + offsets]] = 1
+            shared += np.rint(dense.T @ dense).astype(np.int64)
+
+        result = list()
+        for i, symbol in enumerate(self.symbols):
+            users = int(users_per_symbol[i])
+            overlaps = list()
+            for j in np.argsort(-shared[i], kind="stable"):
+                if j == i or not shared[i, j] or len(overlaps) == top:
+                    continue
+                union = users + int(users_per_symbol[j]) - int(shared[i, j])
+                overlaps.append(
+                    dict(
+                        symbol=self.symbols[j],
+                        shared_users=int(shared[i, j]),
+                        jaccard=round(int(shared[i, j]) / union, 4),
+                    )
+                )
+            shared_users = int(shared[i, i])  # the diagonal only counts multi-symbol users
+            result.append(
+                dict(
+                    symbol=symbol,
+                    users=users,
+                    shared_users=shared_users,
+                    crowd_overlap=round(shared_users / users, 4) if users else 0.0,
+                    top_overlaps=overlaps,
+                )
+            )
+        return result
+
+
+def build_user_graph(symbols=None):
+    """builds the UserGraph of the symbols (every symbol with a cached spotim-config
+    when None) from the UserStat index of the cache"""
+    conversations = dict()
+    for config in ConversationConfig.select():
+        if symbols is None or config.symbol in symbols:
+            conversations[_conversation_id(json.loads(config.config))] = config.symbol
+    graph_symbols = sorted(set(conversations.values()))
+    symbol_index = {symbol: i for i, symbol in enumerate(graph_symbols)}
+
+    user_ids = list()
+    columns = list()
+    counts = list()
+    query = UserStat.select(UserStat.conversation_id, UserStat.user_id, UserStat.comments).where(
+        UserStat.conversation_id.in_(list(conversations))
+    )
+    for conversation_id, user_id, comments in query.tuples().iterator():
+        user_ids.append(user_id)
+        columns.append(symbol_index[conversations[conversation_id]])
+        counts.append(comments)
+
+    unique_users, rows = np.unique(np.array(user_ids, dtype=object), return_inverse=True)
+    columns = np.array(columns, dtype=np.int32)
+    order = np.lexsort((columns, rows))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(unique_users)))))
+    return UserGraph(
+        unique_users,
+        graph_symbols,
+        indptr.astype(np.int64),
+        columns[order],
+        np.array(counts, dtype=np.int64)[order],
+    )
+
+
+def _extend_cache(conversation_info, offset, covered_from, start_date, contiguous=False):
+    """pages older comments into the cache from offset until start_date is covered;
+    returns (covered_from, complete), or None when offset is only an estimate
+    (not contiguous) and turned out to skip past covered_from"""
+    conversation_id = _conversation_id(conversation_info)
+    complete = False
+    for page in _iter_pages(conversation_info, offset):
+        comments = page["comments"]
+        if not contiguous and comments[0]["time"] < covered_from:
+            return None
+        contiguous = True
+        _save_comments(conversation_id, comments)
+        covered_from = min(covered_from, comments[-1]["time"] + 1)
+        if comments[-1]["time"] < start_date:
+            break
+    else:
+        complete = True
+        covered_from = 0
+    return covered_from, complete
+
+
+def refresh_comment_cache(conversation_info, start_date, end_date):
+    """makes sure every comment between start_date and end_date is in the cache,
+    fetching only pages newer than the newest cached comment and, when start_date
+    is older than the cached range, the pages just below it"""
+    conversation_id = _conversation_id(conversation_info)
+    state = CrawlState.get_or_none(CrawlState.conversation_id == conversation_id)
+    if state and state.covered_from <= start_date and end_date < state.newest_time:
+        return state
+
+    newest_time = state.newest_time if state else 0
+    covered_from = None
+    complete = False
+    joined = False
+    fetched = 0
+    for page in _iter_pages(conversation_info, 0):
+        comments = page["comments"]
+        _save_comments(conversation_id, comments)
+        fetched += len(comments)
+        newest_time = max(newest_time, comments[0]["time"])
+        covered_from = comments[-1]["time"] + 1
+        if state and comments[-1]["time"] <= state.newest_time:
+            joined = True
+            break
+        if comments[-1]["time"] < start_date:
+            break
+    else:
+        complete = True
+        covered_from = 0
+
+    if joined:
+        covered_from = min(covered_from, state.covered_from)
+        complete = state.complete
+        if start_date < covered_from and not complete:
+            cached = (
+                CachedComment.select()
+                .where(
+                    (CachedComment.conversation_id == conversation_id)
+                    & (CachedComment.time >= covered_from)
+                    & (CachedComment.time <= state.newest_time)
+                )
+                .count()
+            )
+            # the cached count approximates how deep covered_from sits in the stream;
+            # back off a page, and fall back to paging on from where we stopped on a gap
+            extended = None
+            estimate = fetched + cached - PAGE_SIZE
+            if estimate > fetched:
+                extended = _extend_cache(conversation_info, estimate, covered_from, start_date)
+            if extended is None:
+                extended = _extend_cache(
+                    conversation_info, fetched, covered_from, start_date, contiguous=True
+                )
+            covered_from, complete = extended
+
+    fields = dict(
+        conversation_id=conversation_id,
+        newest_time=newest_time,
+        covered_from=covered_from,
+        complete=complete,
+    )
+    CrawlState.replace(**fields).execute()
+    return CrawlState(**fields)
+
+
+def iter_cached_comments(conversation_info, start_date, end_date):
+    """yields the cached comments between start_date and end_date as Comments, newest first"""
+    query = (
+        CachedComment.select(
+            CachedComment.comment_id,
+            CachedComment.time,
+            CachedComment.user_id,
+            CachedComment.labels,
+            CachedComment.replies_count,
+        )
+        .where(
+            (CachedComment.conversation_id == _conversation_id(conversation_info))
+            & (CachedComment.time >= start_date)
+            & (CachedComment.time <= end_date)
+        )
+        .order_by(CachedComment.time.desc())
+    )
+    for row in query.tuples().iterator():
+        comment_id, comment_time, user_id, labels, replies_count = row
+        flags = 0
+        for label in labels.split(",") if labels else ():
+            flags |= LABEL_FLAGS.get(label, 0)
+        yield Comment(comment_id, comment_time, _intern_user_id(user_id), flags, replies_count)
+
+
+def seek_offset(conversation_info, end_date):
+    """finds an offset at most one page before the first comment at or before end_date,
+    probing offsets exponentially and then binary searching on the page times, so
+    reaching an old date costs O(log history) requests instead of O(history)"""
+    return _seek(conversation_info, end_date)[0]
+
+
+def _seek(conversation_info, end_date, probed=None):
+    """seek_offset, also returning the page starting at the offset when a probe already
+    fetched it (None otherwise), so the pager does not request it again. probed, when
+    given, is filled with the pages fetched by offset"""
+    if probed is None:
+        probed = dict()
+    lo = 0  # every comment before lo is newer than end_date
+    hi = None  # the comment at hi (if any) is at or before end_date
+    probe = 0
+    while hi is None or hi - lo > PAGE_SIZE:
+        if probe not in probed:
+            probed[probe] = _get_comments_block(conversation_info, probe)
+        conversation_data = probed[probe]
+        comments = conversation_data["comments"]
+        if not comments or comments[0]["time"] <= end_date:
+            hi = probe
+        elif comments[-1]["time"] > end_date:
+            lo = probe + len(comments)
+            if not conversation_data["has_next"]:
+                probed[lo] = {"comments": [], "has_next": False}
+                return lo, probed[lo]
+        else:
+            for i, comment in enumerate(comments):
+                if comment["time"] <= end_date:
+                    probed[probe + i] = dict(conversation_data, comments=comments[i:])
+                    return probe + i, probed[probe + i]
+
+        if hi is None:
+            probe = max(lo, 2 * probe)
+        else:
+            probe = lo + (hi - lo) // 2
+    return lo, probed.get(lo)
+
+
+def iter_comments(conversation_info, start_date, end_date, offset=0, seek=True):
+    """yields the comments between start_date and end_date, newest first, one page
+    at a time; paging stops as soon as a page ends before start_date. With seek the
+    pager starts at the page covering end_date (see seek_offset) instead of at offset.
+    With reply expansion enabled (see set_reply_expansion) replies follow as they arrive"""
+    comments = _iter_top_level_comments(conversation_info, start_date, end_date, offset, seek)
+    if MAX_REPLY_THREADS:
+        comments = _with_replies(conversation_info, comments, start_date, end_date)
+    yield from comments
+
+
+def _iter_top_level_comments(conversation_info, start_date, end_date, offset, seek):
+    if not cache_db.deferred:
+        refresh_comment_cache(conversation_info, start_date, end_date)
+        yield from iter_cached_comments(conversation_info, start_date, end_date)
+        return
+
+    if seek and FETCH_WORKERS > 1:
+        yield from _iter_sharded_comments(conversation_info, start_date, end_date)
+        return
+
+    first_page = None
+    if seek:
+        seeked, first_page = _seek(conversation_info, end_date)
+        if seeked < offset:
+            first_page = None
+        offset = max(offset, seeked)
+
+    for page in _iter_pages(conversation_info, offset, first_page):
+        yield from _page_in_range(page["comments"], start_date, end_date)
+        if page["comments"][-1]["time"] < start_date:
+            return
+
+
+def set_fetch_workers(workers):
+    """fetches the comment pages of a date range on this many threads at once
+    (see _iter_sharded_comments); 0 or 1 fetches them one after another"""
+    global FETCH_WORKERS
+    FETCH_WORKERS = max(0, workers)
+
+
+def _iter_sharded_comments(conversation_info, start_date, end_date):
+    """iter_comments with the pages fetched in parallel on FETCH_WORKERS threads.
+    From the page the seek of end_date probed, up to FETCH_WORKERS pages are kept in
+    flight, a tenth of a page overlapping the next, and consumed in offset order.
+    Pages are only requested down to where start_date is expected at the comment
+    rate of the last consumed page (see _estimate_offset), plus the next one.
+    Comments are deduplicated by id, and a seam without a shared comment (more posts
+    arrived between the fetches of two neighbouring pages than the overlap absorbs)
+    is refilled by paging through it"""
+    probed = dict()
+    first = _seek(conversation_info, end_date, probed)[0]
+    # start at the full page the seek probed around first, not one sliced at end_date
+    next_offset = min(
+        (probe for probe, page in probed.items() if probe <= first < probe + len(page["comments"])),
+        default=first,
+    )
+    stride = max(1, PAGE_SIZE - PAGE_SIZE // 10)
+    pending = deque()
+    seen = set()
+
+    def schedule():
+        nonlocal next_offset
+        if next_offset in probed:
+            future = Future()
+            future.set_result(probed.pop(next_offset))
+        else:
+            future = pool.submit(
+                contextvars.copy_context().run, _get_comments_block, conversation_info, next_offset
+            )
+        pending.append((next_offset, future))
+        next_offset = next_offset + stride
+
+    def fresh(comments):
+        for comment in _page_in_range(comments, start_date, end_date):
+            if comment["id"] not in seen:
+                seen.add(comment["id"])
+                yield comment
+
+    def refill(offset, until_time):
+        for page in _iter_pages(conversation_info, offset):
+            yield from fresh(page["comments"])
+            if page["comments"][-1]["time"] <= until_time:
+                return
+
+    pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS)
+    try:
+        schedule()
+        previous_offset = previous = None
+        while pending:
+            offset, future = pending.popleft()
+            page = future.result()
+            comments = page["comments"]
+            if previous is not None:
+                previous_ids = {comment["id"] for comment in previous["comments"]}
+                if not comments or previous_ids.isdisjoint(comment["id"] for comment in comments):
+                    yield from refill(
+                        previous_offset, comments[0]["time"] if comments else start_date - 1
+                    )
+            if not comments:
+                return
+            yield from fresh(comments)
+            if comments[-1]["time"] < start_date or not page["has_next"]:
+                return
+            previous_offset, previous = offset, page
+
+            expected = _estimate_offset(offset, page, start_date)
+            while len(pending) < FETCH_WORKERS and (next_offset <= expected or not pending):
+                schedule()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _estimate_offset(offset, page, start_date):
+    """the offset the first comment at or before start_date is expected at, going by
+    the comment rate of the newest first page at offset"""
+    comments = page["comments"]
+    newest = comments[0]["time"]
+    seconds = max(1, newest - comments[-1]["time"])
+    return offset + int(len(comments) * (newest - start_date) / seconds)
+
+
+def _page_in_range(comments, start_date, end_date):
+    """the comments of a non-empty, newest first page between start_date and end_date.
+    Its first and last times settle pages wholly outside (skipped) or inside the
+    range; only pages straddling a boundary are filtered comment by comment"""
+    newest = comments[0]["time"]
+    oldest = comments[-1]["time"]
+    if oldest > end_date or newest < start_date:
+        _count(pages_skipped=1)
+        return ()
+    _count(pages_scanned=1)
+    if start_date <= oldest and newest <= end_date:
+        return comments
+    return [comment for comment in comments if start_date <= comment["time"] <= end_date]
+
+
+def set_reply_expansion(max_threads, concurrency=REPLY_CONCURRENCY):
+    """makes iter_comments also fetch the replies of up to max_threads threads per
+    walk, concurrency threads at a time; 0 disables reply expansion"""
+    global MAX_REPLY_THREADS, REPLY_CONCURRENCY
+    MAX_REPLY_THREADS = max(0, max_threads)
+    REPLY_CONCURRENCY = max(1, concurrency)
+
+
+def get_replies(conversation_info, parent_id):
+    """returns every reply to the comment parent_id, newest first"""
+    replies = list()
+    offset = 0
+    while True:
+        page = _get_replies_block(conversation_info, parent_id, offset)
+        replies.extend(page["comments"])
+        if not page["comments"] or not page["has_next"]:
+            return replies
+        offset = offset + len(page["comments"])
+
+
+def _with_replies(conversation_info, comments, start_date, end_date):
+    """yields the comments and, as their fetches complete, the replies between
+    start_date and end_date of those with replies_count > 0, deduplicated by id.
+    At most MAX_REPLY_THREADS threads are expanded (in stream order, nested replies
+    included) on a pool of REPLY_CONCURRENCY threads; the rest are only counted as
+    reply_threads_skipped in the metrics. Replies to comments outside the date range
+    are not looked for"""
+    seen = set()
+    pending = set()
+    expanded = 0
+    skipped = 0
+    pool = ThreadPoolExecutor(max_workers=REPLY_CONCURRENCY)
+
+    def accept(comment):
+        nonlocal expanded, skipped
+        if comment["id"] in seen:
+            return False
+        seen.add(comment["id"])
+        if comment.get("replies_count", 0) > 0:
+            if expanded < MAX_REPLY_THREADS:
+                expanded += 1
+                context = contextvars.copy_context()
+                pending.add(pool.submit(context.run, get_replies, conversation_info, comment["id"]))
+            else:
+                skipped += 1
+        return True
+
+    def finished_replies(block):
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            for reply in future.result():
+                if start_date <= reply["time"] <= end_date and accept(reply):
+                    yield reply
+
+    try:
+        for comment in comments:
+            if accept(comment):
+                yield comment
+            if pending:
+                yield from finished_replies(block=False)
+        while pending:
+            yield from finished_replies(block=True)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        _count(reply_threads=expanded, reply_threads_skipped=skipped)
+
+
+def get_comment_data(conversation_info, start_date, end_date, offset=0):
+    """returns the comments between start_date and end_date as a list, see iter_comments"""
+    return list(iter_comments(conversation_info, start_date, end_date, offset))
+
+
+def fetch_new_comments(conversation_info, since_time, seen_ids=()):
+    """returns the comments posted at or after since_time, newest first, minus the
+    ids in seen_ids; pages only until a page reaches older comments"""
+    comments = list()
+    for page in _iter_pages(conversation_info, 0):
+        for comment in page["comments"]:
+            if comment["time"] >= since_time and comment["id"] not in seen_ids:
+                comments.append(comment)
+        if page["comments"][-1]["time"] < since_time:
+            break
+    return comments
+
+
+async def _run_in_thread(func, *args):
+    """runs a blocking call on the event loop's executor so the shared
+    keep-alive session (and its retry policy) serves the async engine too"""
+    loop = asyncio.get_running_loop()
+    # copy the context so a profiled run keeps collecting its metrics in the thread
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args))
+
+
+async def async_get_conversation_info(symbol):
+    return await _run_in_thread(get_conversation_info, symbol)
+
+
+async def async_get_comments_block(conversation_info, offset):
+    return await _run_in_thread(_get_comments_block, conversation_info, offset)
+
+
+async def aiter_comments(
+    conversation_info, start_date, end_date, offset=0, seek=True, prefetch=DEFAULT_PREFETCH
+):
+    """async version of iter_comments that keeps up to prefetch page requests in
+    flight ahead of the consumer; requests still outstanding once start_date is
+    crossed are cancelled"""
+    if not cache_db.deferred:
+        for comment in await _run_in_thread(get_comment_data, conversation_info, start_date, end_date):
+            yield comment
+        return
+
+    first_page = None
+    if seek:
+        seeked, first_page = await _run_in_thread(_seek, conversation_info, end_date)
+        if seeked < offset:
+            first_page = None
+        offset = max(offset, seeked)
+
+    pending = deque()
+    next_offset = offset
+    if first_page is not None:
+        # the page the seek already fetched is served as a resolved request
+        resolved = asyncio.get_running_loop().create_future()
+        resolved.set_result(first_page)
+        pending.append((offset, resolved))
+        next_offset = offset + len(first_page["comments"])
+
+    def schedule():
+        nonlocal next_offset
+        task = asyncio.ensure_future(async_get_comments_block(conversation_info, next_offset))
+        pending.append((next_offset, task))
+        next_offset = next_offset + PAGE_SIZE
+
+    def cancel_pending():
+        while pending:
+            pending.popleft()[1].cancel()
+
+    try:
+        if first_page is None or (first_page["comments"] and first_page["has_next"]):
+            while len(pending) < max(1, prefetch):
+                schedule()
+        while pending:
+            page_offset, task = pending.popleft()
+            conversation_data = await task
+            comments = conversation_data["comments"]
+            expected_offset = pending[0][0] if pending else next_offset
+            if not comments or not conversation_data["has_next"]:
+                cancel_pending()
+            elif page_offset + len(comments) != expected_offset:
+                # a short page shifts every speculative offset after it
+                cancel_pending()
+                next_offset = page_offset + len(comments)
+            while len(pending) < max(1, prefetch) and conversation_data["has_next"] and comments:
+                schedule()
+
+            if not comments:
+                return
+            for comment in _page_in_range(comments, start_date, end_date):
+                yield comment
+            if comments[-1]["time"] < start_date:
+                return
+    finally:
+        cancel_pending()
 
 
 def get_start_of_day(the_date=""):
@@ -218,35 +1877,1034 @@ def get_end_of_day(the_date=""):
     return int(end_of_day.timestamp())
 
 
-@click.command()
+def parse_symbols(symbols="", symbols_file=""):
+    """builds a de-duplicated, ordered list of symbols from a comma separated string
+    and/or a file containing one symbol per line (blank lines and # comments are ignored)"""
+    result = list()
+    candidates = symbols.split(",") if symbols else list()
+    if symbols_file:
+        with open(symbols_file) as f:
+            for line in f:
+                candidates.append(line.split("#", 1)[0])
+
+    for candidate in candidates:
+        candidate = candidate.strip().upper()
+        if candidate and candidate not in result:
+            result.append(candidate)
+    return result
+
+
+def _symbol_result(
+    symbol, start_date, end_date, comment_result, price_result, processing_start_time, options
+):
+    result = {**comment_result, **price_result}
+    result["symbol"] = symbol
+    result["start_date"] = start_date
+    result["end_date"] = end_date
+    result["processing_start_time"] = processing_start_time
+    result["processing_end_time"] = int(time.time())
+    if "error" not in comment_result:
+        # a price error is kept: days without trading stay without a price
+        _store_result(result, options)
+    return result
+
+
+def _scoring_options(record_users, with_price):
+    """the settings that shape a result, stored with it (see query_results)"""
+    return dict(
+        record_users=bool(record_users),
+        with_price=bool(with_price),
+        max_reply_threads=MAX_REPLY_THREADS,
+        max_user_weight=MAX_USER_WEIGHT,
+    )
+
+
+def _store_result(result, options):
+    """keeps the result of a single day that is over in the DailyResult table
+    (when caching is enabled), with the options it was scored with; see query_results"""
+    if cache_db.deferred or result["end_date"] >= time.time():
+        return
+    day = datetime.fromtimestamp(result["start_date"]).strftime("%Y-%m-%d")
+    if result["start_date"] != get_start_of_day(day) or result["end_date"] != get_end_of_day(day):
+        return
+    if "error" in result and PriceBar.get_or_none(
+        (PriceBar.symbol == result["symbol"]) & (PriceBar.date == day)
+    ) is None:
+        # the price lookup failed, as opposed to finding a day without trading
+        return
+    DailyResult.replace(
+        symbol=result["symbol"],
+        start_date=result["start_date"],
+        result=json.dumps(result),
+        options=json.dumps(options),
+    ).execute()
+
+
+def score_symbol(symbol, start_date, end_date, record_users=False, with_price=True):
+    """fetches and scores the comments and (unless with_price is False) the
+    price info for a single symbol"""
+    processing_start_time = time.time()
+
+    comment_result = _with_conversation(
+        symbol,
+        lambda conversation_data: score_comments(
+            _archived(
+                iter_comments(conversation_data, start_date, end_date), symbol, start_date, end_date
+            ),
+            record_users=record_users,
+        ),
+    )
+    price_result = dict()
+    if with_price:
+        price_result = get_stock_info(symbol, start_date=start_date, end_date=end_date)
+
+    return _symbol_result(
+        symbol,
+        start_date,
+        end_date,
+        comment_result,
+        price_result,
+        processing_start_time,
+        _scoring_options(record_users, with_price),
+    )
+
+
+async def async_score_symbol(
+    symbol, start_date, end_date, record_users=False, with_price=True, prefetch=DEFAULT_PREFETCH
+):
+    """score_symbol on the async engine, scoring each page while the next ones download"""
+    processing_start_time = time.time()
+
+    async def score(conversation_data):
+        comment_result = _new_score()
+        kept = list()
+        scoring_seconds = 0.0
+        async for comment in aiter_comments(
+            conversation_data, start_date, end_date, prefetch=prefetch
+        ):
+            scoring_start = time.perf_counter()
+            _add_to_score(comment_result, comment, record_users=record_users)
+            scoring_seconds += time.perf_counter() - scoring_start
+            if _archive_dir:
+                kept.append(comment)
+        metrics = _metrics.get()
+        if metrics:
+            # only the scoring between pages, not the time spent awaiting them
+            metrics.add("score_comments", scoring_seconds)
+        if _archive_dir:
+            archive_days(_archive_dir, symbol, kept, start_date, end_date)
+        return _finish_score(comment_result)
+
+    conversation_data = get_cached_conversation_info(symbol)
+    comment_result = None
+    if conversation_data is not None:
+        try:
+            comment_result = await score(conversation_data)
+        except (requests.HTTPError, ValueError):
+            invalidate_conversation_info(symbol)
+    if comment_result is None:
+        comment_result = await score(await async_get_conversation_info(symbol))
+
+    price_result = dict()
+    if with_price:
+        price_result = await _run_in_thread(get_stock_info, symbol, start_date, end_date)
+
+    return _symbol_result(
+        symbol,
+        start_date,
+        end_date,
+        comment_result,
+        price_result,
+        processing_start_time,
+        _scoring_options(record_users, with_price),
+    )
+
+
+def score_symbol_by_day(symbol, start_date, end_date, record_users=False, with_price=True):
+    """fetches the comments for the whole date range once and returns one
+    result per calendar day, with a single price history download"""
+    processing_start_time = time.time()
+
+    comment_results = _with_conversation(
+        symbol,
+        lambda conversation_data: score_comments_by_day(
+            _archived(
+                iter_comments(conversation_data, start_date, end_date), symbol, start_date, end_date
+            ),
+            start_date,
+            end_date,
+            record_users=record_users,
+        ),
+    )
+    price_results = {day: dict() for day in comment_results}
+    if with_price:
+        price_results = get_stock_info_by_day(symbol, list(comment_results.keys()))
+    options = _scoring_options(record_users, with_price)
+
+    return [
+        _symbol_result(
+            symbol,
+            get_start_of_day(day),
+            get_end_of_day(day),
+            comment_result,
+            price_results[day],
+            processing_start_time,
+            options,
+        )
+        for day, comment_result in comment_results.items()
+    ]
+
+
+def rescore_symbol_by_day(symbol, start_date, end_date, record_users=False, with_price=True):
+    """score_symbol_by_day from the comment archive only; days that are not
+    archived yield an error result"""
+    processing_start_time = time.time()
+    days = get_days(start_date, end_date)
+    comment_results = rescore_archive(_archive_dir, symbol, days, record_users=record_users)
+    price_results = {day: dict() for day in days}
+    if with_price:
+        price_results = get_stock_info_by_day(symbol, days)
+    options = _scoring_options(record_users, with_price)
+
+    results = list()
+    for day, comment_result in comment_results.items():
+        if comment_result is None:
+            comment_result = {"error": f"No archived comments for {symbol} on {day}"}
+        results.append(
+            _symbol_result(
+                symbol,
+                get_start_of_day(day),
+                get_end_of_day(day),
+                comment_result,
+                price_results[day],
+                processing_start_time,
+                options,
+            )
+        )
+    return results
+
+
+def score_symbols(
+    symbols,
+    start_date,
+    end_date,
+    record_users=False,
+    concurrency=DEFAULT_CONCURRENCY,
+    group_by="none",
+    from_archive=False,
+    with_price=True,
+    profile=False,
+    emit=print,
+):
+    """scores many symbols over a bounded thread pool, emitting one JSON line per symbol
+    (or per symbol and day) as soon as it finishes; a failing symbol yields an error
+    line instead of aborting the batch. With profile each symbol carries its metrics"""
+    if with_price:
+        prefetch_prices(symbols, get_days(start_date, end_date))
+
+    worker = score_symbol_by_day if group_by == "day" else score_symbol
+    if from_archive:
+        worker = rescore_symbol_by_day
+    if profile:
+        worker = functools.partial(profiled, worker)
+    results = list()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(worker, symbol, start_date, end_date, record_users, with_price): symbol
+            for symbol in symbols
+        }
+        for future in as_completed(futures):
+            try:
+                symbol_results = future.result()
+            except Exception as e:
+                symbol_results = {"symbol": futures[future], "error": str(e)}
+            if isinstance(symbol_results, dict):
+                symbol_results = [symbol_results]
+            for result in symbol_results:
+                emit(json.dumps(result))
+                results.append(result)
+    return results
+
+
+async def async_score_symbols(
+    symbols,
+    start_date,
+    end_date,
+    record_users=False,
+    concurrency=DEFAULT_CONCURRENCY,
+    prefetch=DEFAULT_PREFETCH,
+    with_price=True,
+    profile=False,
+    emit=print,
+):
+    """score_symbols on a single event loop: at most concurrency symbols are
+    in progress, each with up to prefetch pages in flight"""
+    if with_price:
+        prefetch_prices(symbols, get_days(start_date, end_date))
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    score = async_score_symbol
+    if profile:
+        score = functools.partial(async_profiled, async_score_symbol)
+
+    async def worker(symbol):
+        async with semaphore:
+            try:
+                return await score(
+                    symbol,
+                    start_date,
+                    end_date,
+                    record_users=record_users,
+                    with_price=with_price,
+                    prefetch=prefetch,
+                )
+            except Exception as e:
+                return {"symbol": symbol, "error": str(e)}
+
+    results = list()
+    for future in asyncio.as_completed([worker(symbol) for symbol in symbols]):
+        result = await future
+        emit(json.dumps(result))
+        results.append(result)
+    return results
+
+
+_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_windows(windows):
+    """parses a comma separated list of window lengths such as 15m,1h,4h,24h
+    into an ordered dict of name -> seconds"""
+    result = dict()
+    for name in windows.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            seconds = int(name[:-1]) * _WINDOW_UNITS[name[-1]]
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid window: {name}. Expected a number followed by s, m, h or d.")
+        result[name] = seconds
+    return result
+
+
+class SlidingWindow:
+    """bulls/bears/neutral counts over the comments of the last width seconds;
+    comments are kept in time order in a ring buffer (deque) so inserting and
+    evicting are O(1) amortized"""
+
+    def __init__(self, width):
+        self.width = width
+        self.buffer = deque()
+        self.bulls = 0
+        self.bears = 0
+        self.neutral = 0
+
+    def _count(self, bullish, bearish, step):
+        if bullish:
+            self.bulls += step
+        if bearish:
+            self.bears += step
+        if not bullish and not bearish:
+            self.neutral += step
+
+    def add(self, comment_time, bullish, bearish):
+        """adds a comment; comments must be added oldest first"""
+        self.buffer.append((comment_time, bullish, bearish))
+        self._count(bullish, bearish, 1)
+
+    def advance(self, now):
+        """evicts the comments older than now - width"""
+        while self.buffer and self.buffer[0][0] <= now - self.width:
+            _, bullish, bearish = self.buffer.popleft()
+            self._count(bullish, bearish, -1)
+
+    def result(self):
+        return dict(
+            bulls=self.bulls,
+            bears=self.bears,
+            neutral=self.neutral,
+            score=self.bulls - self.bears,
+        )
+
+
+class WindowedSentiment:
+    """a set of sliding windows (see parse_windows) fed from the same comment stream"""
+
+    def __init__(self, windows):
+        self.windows = {name: SlidingWindow(width) for name, width in windows.items()}
+        self.max_width = max(windows.values())
+        self.newest_time = 0
+
+    def add_comments(self, comments):
+        """adds a batch of comments in any order; comments older than the
+        newest one already added are dropped since the windows are time ordered"""
+        for comment in sorted(comments, key=lambda comment: comment["time"]):
+            if comment["time"] < self.newest_time:
+                continue
+            self.newest_time = comment["time"]
+            labels = _comment_labels(comment)
+            bullish = "BULLISH" in labels
+            bearish = "BEARISH" in labels
+            for window in self.windows.values():
+                window.add(comment["time"], bullish, bearish)
+
+    def result(self, now):
+        """evicts what fell out of each window by now and returns name -> counts"""
+        result = dict()
+        for name, window in self.windows.items():
+            window.advance(now)
+            result[name] = window.result()
+        return result
+
+
+class SymbolWatch:
+    """in-process sentiment state of one watched symbol: running totals for the
+    current day and optional sliding windows; each poll only fetches and scores
+    the comments posted since the last one"""
+
+    def __init__(self, symbol, record_users=False, windows=None):
+        self.symbol = symbol
+        self.record_users = record_users
+        self.windows = WindowedSentiment(windows) if windows else None
+        self.conversation_info = None
+        self.day_start = None
+        self.last_time = None
+        self.last_ids = set()  # ids of the comments posted at last_time
+        self.ticks = 0
+
+    def poll(self):
+        """fetches the new comments, updates the running state and returns the delta line"""
+        if self.conversation_info is None:
+            self.conversation_info = get_cached_conversation_info(self.symbol)
+            if self.conversation_info is None:
+                self.conversation_info = get_conversation_info(self.symbol)
+        now = int(time.time())
+        day_start = get_start_of_day()
+        if day_start != self.day_start:
+            self.day_start = day_start
+            self.totals = _new_score()
+        if self.last_time is None:
+            self.last_time = day_start
+            if self.windows:
+                self.last_time = min(day_start, now - self.windows.max_width)
+
+        try:
+            comments = fetch_new_comments(self.conversation_info, self.last_time, self.last_ids)
+        except (requests.HTTPError, ValueError):
+            # the config may be stale (see _with_conversation): scrape a fresh one next tick
+            invalidate_conversation_info(self.symbol)
+            self.conversation_info = None
+            raise
+        delta = _new_score()
+        new_comments = 0
+        for comment in comments:
+            if comment["time"] >= day_start:
+                new_comments += 1
+                _add_to_score(delta, comment, record_users=self.record_users)
+                _add_to_score(self.totals, comment, record_users=self.record_users)
+            if comment["time"] > self.last_time:
+                self.last_time = comment["time"]
+                self.last_ids = set()
+            if comment["time"] == self.last_time:
+                self.last_ids.add(comment["id"])
+        self.ticks += 1
+
+        totals = dict(
+            self.totals,
+            bull_users=list(self.totals["bull_users"]),
+            bear_users=list(self.totals["bear_users"]),
+        )
+        result = {
+            "symbol": self.symbol,
+            "tick": self.ticks,
+            "tick_time": now,
+            "new_comments": new_comments,
+            "delta": _finish_score(delta),
+            "totals": _finish_score(totals),
+        }
+        if self.windows:
+            self.windows.add_comments(comments)
+            result["windows"] = self.windows.result(now)
+        return result
+
+
+def watch(
+    symbols,
+    interval,
+    record_users=False,
+    concurrency=DEFAULT_CONCURRENCY,
+    windows=None,
+    ticks=None,
+    emit=print,
+):
+    """polls the symbols every interval seconds (ticks times, forever if None),
+    emitting one delta JSON line per symbol and tick; errors are emitted and the
+    symbol is polled again on the next tick"""
+    watches = [
+        SymbolWatch(symbol, record_users=record_users, windows=windows) for symbol in symbols
+    ]
+
+    def poll(symbol_watch):
+        try:
+            return symbol_watch.poll()
+        except Exception as e:
+            return {"symbol": symbol_watch.symbol, "error": str(e)}
+
+    tick = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        while ticks is None or tick < ticks:
+            tick_start = time.monotonic()
+            for line in pool.map(poll, watches):
+                emit(json.dumps(line))
+            tick += 1
+            if ticks is None or tick < ticks:
+                time.sleep(max(0, interval - (time.monotonic() - tick_start)))
+
+
+def read_checkpoint(path):
+    """returns the (symbol, day) cells recorded as done in a backfill checkpoint file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                cell = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            done.add((cell["symbol"], cell["date"]))
+    return done
+
+
+def plan_backfill(symbols, days, done, shard_days=DEFAULT_SHARD_DAYS):
+    """splits the (symbol, day) cells not yet done into shards of at most
+    shard_days consecutive days of one symbol; returns (symbol, first_day, last_day) tuples"""
+    shards = list()
+    for symbol in symbols:
+        run = list()
+        for day in days:
+            if (symbol, day) not in done:
+                run.append(day)
+            if run and ((symbol, day) in done or len(run) == shard_days):
+                shards.append((symbol, run[0], run[-1]))
+                run = list()
+        if run:
+            shards.append((symbol, run[0], run[-1]))
+    return shards
+
+
+def _init_backfill_worker(
+    http_settings, cache_path, archive_dir, page_size, max_user_weight, reply_expansion, fetch_workers
+):
+    configure_http(**http_settings)
+    set_page_size(page_size)
+    set_fetch_workers(fetch_workers)
+    set_max_user_weight(max_user_weight)
+    set_reply_expansion(*reply_expansion)
+    if cache_path:
+        open_cache(cache_path)
+    set_archive_dir(archive_dir)
+
+
+def _backfill_shard(symbol, first_day, last_day, record_users=False, with_price=True):
+    return score_symbol_by_day(
+        symbol,
+        get_start_of_day(first_day),
+        get_end_of_day(last_day),
+        record_users=record_users,
+        with_price=with_price,
+    )
+
+
+def run_backfill(
+    symbols,
+    start_date,
+    end_date,
+    checkpoint,
+    workers=None,
+    shard_days=DEFAULT_SHARD_DAYS,
+    record_users=False,
+    with_price=True,
+    emit=print,
+    pool=None,
+):
+    """scores every (symbol, day) cell of the date range across a process pool,
+    one walk of the comment stream per shard (see plan_backfill). Finished cells
+    are appended to the checkpoint file and skipped when the backfill is rerun;
+    days that are not over yet are emitted but never checkpointed. Raises a
+    click.ClickException once the other shards are done if any shard failed"""
+    days = get_days(start_date, end_date)
+    shards = plan_backfill(symbols, days, read_checkpoint(checkpoint), shard_days)
+    if not shards:
+        return list()
+
+    if with_price:
+        prefetch_prices(sorted({shard[0] for shard in shards}), days)
+    cache_path = None if cache_db.deferred else cache_db.database
+    if pool is None:
+        # spawn so no worker inherits an open SQLite connection
+        if not cache_db.deferred:
+            cache_db.close()
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_backfill_worker,
+            initargs=(
+                dict(HTTP_SETTINGS),
+                cache_path,
+                _archive_dir,
+                PAGE_SIZE,
+                MAX_USER_WEIGHT,
+                (MAX_REPLY_THREADS, REPLY_CONCURRENCY),
+                FETCH_WORKERS,
+            ),
+        )
+
+    results = list()
+    failed = 0
+    with pool, open(checkpoint, "a") as checkpoint_file:
+        futures = {
+            pool.submit(_backfill_shard, symbol, first_day, last_day, record_users, with_price): (
+                symbol,
+                first_day,
+                last_day,
+            )
+            for symbol, first_day, last_day in shards
+        }
+        for future in as_completed(futures):
+            symbol, first_day, last_day = futures[future]
+            try:
+                shard_results = future.result()
+            except Exception as e:
+                click.echo(f"backfill of {symbol} {first_day}..{last_day} failed: {e}", err=True)
+                failed += 1
+                continue
+            for result in shard_results:
+                emit(json.dumps(result))
+                results.append(result)
+                if result["end_date"] < time.time():
+                    day = datetime.fromtimestamp(result["start_date"]).strftime("%Y-%m-%d")
+                    checkpoint_file.write(json.dumps({"symbol": symbol, "date": day}) + "\n")
+            checkpoint_file.flush()
+    if failed:
+        raise click.ClickException(f"{failed} of {len(shards)} backfill shards failed; rerun to retry them")
+    return results
+
+
+def query_results(
+    symbols,
+    start_date,
+    end_date,
+    record_users=False,
+    with_price=True,
+    concurrency=DEFAULT_CONCURRENCY,
+    shard_days=DEFAULT_SHARD_DAYS,
+):
+    """returns the result of every symbol and day of the date range, ordered by symbol
+    and day, from the DailyResult table; only the missing cells (and days that are
+    not over yet) are scored, one walk of the comment stream per shard of missing
+    days (see plan_backfill). A stored result counts as missing when it was scored
+    with other options (record_users, reply expansion, max user weight), or without
+    a price when with_price is set. A failing shard yields an error result per day"""
+    days = get_days(start_date, end_date)
+    wanted = _scoring_options(record_users, with_price)
+    stored = dict()
+    rows = DailyResult.select().where(
+        DailyResult.symbol.in_(symbols)
+        & DailyResult.start_date.between(get_start_of_day(days[0]), get_start_of_day(days[-1]))
+    )
+    for row in rows:
+        options = json.loads(row.options or "null")
+        if options is None or (with_price and not options["with_price"]):
+            continue
+        if dict(options, with_price=with_price) != wanted:
+            continue
+        result = json.loads(row.result)
+        stored[(row.symbol, datetime.fromtimestamp(row.start_date).strftime("%Y-%m-%d"))] = result
+
+    shards = plan_backfill(symbols, days, set(stored), shard_days)
+    if with_price and shards:
+        prefetch_prices(sorted({shard[0] for shard in shards}), days)
+    errors = dict()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(_backfill_shard, symbol, first_day, last_day, record_users, with_price): (
+                symbol,
+                first_day,
+                last_day,
+            )
+            for symbol, first_day, last_day in shards
+        }
+        for future in as_completed(futures):
+            symbol, first_day, last_day = futures[future]
+            try:
+                shard_results = future.result()
+            except Exception as e:
+                for day in get_days(get_start_of_day(first_day), get_end_of_day(last_day)):
+                    errors[(symbol, day)] = {
+                        "symbol": symbol,
+                        "start_date": get_start_of_day(day),
+                        "end_date": get_end_of_day(day),
+                        "error": str(e),
+                    }
+                continue
+            for result in shard_results:
+                day = datetime.fromtimestamp(result["start_date"]).strftime("%Y-%m-%d")
+                stored[(symbol, day)] = result
+
+    results = list()
+    for symbol in symbols:
+        for day in days:
+            if (symbol, day) in errors:
+                results.append(errors[(symbol, day)])
+            elif (symbol, day) in stored:
+                results.append(stored[(symbol, day)])
+    return results
+
+
+@click.group(invoke_without_command=True)
 @click.option("--symbol", default="QBTS", help="Symbol to score")
+@click.option("--symbols", default="", help="Comma separated list of symbols to score in one batch")
+@click.option("--symbols_file", default="", help="File with one symbol per line to score in one batch")
+@click.option("--concurrency", default=DEFAULT_CONCURRENCY, help="Number of symbols fetched at once in batch mode")
 @click.option("--record_users", default=False, help="If True record the user ids of bulls and bears")
+@click.option("--no_price", default=False, is_flag=True, help="Skip the yahoo finance price lookup")
+@click.option(
+    "--max_user_weight",
+    default=0,
+    help="Add a weighted_score counting at most this many bullish and bearish comments per user; 0 to skip",
+)
+@click.option(
+    "--include_replies",
+    default=False,
+    is_flag=True,
+    help="Also fetch and score the replies of the threads in the date range",
+)
+@click.option(
+    "--max_reply_threads",
+    default=DEFAULT_MAX_REPLY_THREADS,
+    help="With --include_replies, max threads expanded per symbol",
+)
+@click.option(
+    "--reply_concurrency",
+    default=REPLY_CONCURRENCY,
+    help="With --include_replies, threads whose replies are fetched at once per symbol",
+)
 @click.option("--start_date", default="", help="Starting Date to check %Y-%m-%d; if blank uses today")
 @click.option("--end_date", default="", help="Ending Date %Y-%m-%d; if blank use today")
-def main(symbol, record_users, start_date, end_date):
-    processing_start_time = time.time()
+@click.option("--retries", default=HTTP_SETTINGS["retries"], help="Retries per request on connection errors, 429 and 5xx")
+@click.option("--timeout", default=HTTP_SETTINGS["timeout"], help="Seconds before a request times out")
+@click.option("--rate_limit", default=float(HTTP_SETTINGS["rate_limit"]), help="Max requests per second per host; 0 for no limit")
+@click.option(
+    "--page_size",
+    default=DEFAULT_PAGE_SIZE,
+    help="Comments requested per conversation page; falls back to the size the API serves",
+)
+@click.option(
+    "--fetch_workers",
+    default=0,
+    help="Fetch the comment pages of the date range on this many threads at once; 0 fetches them one by one",
+)
+@click.option("--cache_db", "cache_path", default="", help="SQLite file caching fetched comments between runs; if blank nothing is cached")
+@click.option(
+    "--group_by",
+    default="none",
+    type=click.Choice(["none", "day"]),
+    help="day: walk the comments once and print one result per day of the date range",
+)
+@click.option(
+    "--prefetch",
+    default=0,
+    help="Use the asyncio engine with this many comment pages requested ahead; 0 fetches pages one by one",
+)
+@click.option(
+    "--watch",
+    "watch_interval",
+    default=0,
+    help="Keep running and print the new sentiment of today every INTERVAL seconds",
+)
+@click.option(
+    "--windows",
+    default="",
+    help="With --watch, also report sliding windows, e.g. 15m,1h,4h,24h",
+)
+@click.option("--archive_dir", default="", help="Directory where complete days of comments are archived as numpy record files")
+@click.option(
+    "--from_archive",
+    default=False,
+    is_flag=True,
+    help="Score each day of the range from --archive_dir only, without fetching comments",
+)
+@click.option(
+    "--profile",
+    default=False,
+    is_flag=True,
+    help="Add a metrics object with per stage wall times, bytes downloaded, pages fetched and retries",
+)
+@click.option(
+    "--prometheus_file",
+    default="",
+    help="With --profile, also write the metrics to this file in the Prometheus text format",
+)
+@click.pass_context
+def main(
+    ctx,
+    symbol,
+    symbols,
+    symbols_file,
+    concurrency,
+    record_users,
+    no_price,
+    max_user_weight,
+    include_replies,
+    max_reply_threads,
+    reply_concurrency,
+    start_date,
+    end_date,
+    retries,
+    timeout,
+    rate_limit,
+    page_size,
+    fetch_workers,
+    cache_path,
+    group_by,
+    prefetch,
+    watch_interval,
+    windows,
+    archive_dir,
+    from_archive,
+    profile,
+    prometheus_file,
+):
+    # every symbol in flight can hold this many requests to the host at once
+    requests_per_symbol = max(1, fetch_workers, reply_concurrency if include_replies else 1, prefetch)
+    configure_http(
+        retries=retries,
+        timeout=timeout,
+        rate_limit=rate_limit,
+        pool_size=max(HTTP_SETTINGS["pool_size"], concurrency * requests_per_symbol),
+    )
+    set_page_size(page_size)
+    set_fetch_workers(fetch_workers)
+    set_max_user_weight(max_user_weight)
+    set_reply_expansion(max_reply_threads if include_replies else 0, reply_concurrency)
+    if cache_path:
+        open_cache(cache_path)
+    set_archive_dir(archive_dir)
+    if from_archive and not archive_dir:
+        raise click.UsageError("--from_archive needs --archive_dir")
+    if from_archive and (prefetch or watch_interval):
+        raise click.UsageError("--from_archive cannot be combined with --prefetch or --watch")
+    if prometheus_file and not profile:
+        raise click.UsageError("--prometheus_file needs --profile")
+    if profile and watch_interval:
+        raise click.UsageError("--profile cannot be combined with --watch")
+    if include_replies and (prefetch or watch_interval):
+        raise click.UsageError("--include_replies cannot be combined with --prefetch or --watch")
+    if windows and not watch_interval:
+        raise click.UsageError("--windows needs --watch")
+    if ctx.invoked_subcommand:
+        # the options above configure HTTP, the cache and the archive for the subcommand
+        return
 
     start_date = get_start_of_day(start_date)
 
     end_date = get_end_of_day(end_date)
 
-    conversation_data = get_conversation_info(symbol)
+    if watch_interval:
+        return watch(
+            parse_symbols(symbols, symbols_file) or [symbol],
+            watch_interval,
+            record_users=record_users,
+            concurrency=concurrency,
+            windows=parse_windows(windows),
+        )
 
-    comments_data = get_comment_data(conversation_data, start_date, end_date, offset=0)
+    if prefetch and group_by == "day":
+        raise click.UsageError("--prefetch is not supported with --group_by=day")
 
-    comment_result = score_comments(comments_data, record_users=record_users)
-    price_result = get_stock_info(symbol, start_date=start_date, end_date=end_date)
+    if prefetch and (symbols or symbols_file):
+        results = asyncio.run(
+            async_score_symbols(
+                parse_symbols(symbols, symbols_file),
+                start_date,
+                end_date,
+                record_users=record_users,
+                concurrency=concurrency,
+                prefetch=prefetch,
+                with_price=not no_price,
+                profile=profile,
+            )
+        )
+    elif symbols or symbols_file:
+        results = score_symbols(
+            parse_symbols(symbols, symbols_file),
+            start_date,
+            end_date,
+            record_users=record_users,
+            concurrency=concurrency,
+            group_by=group_by,
+            from_archive=from_archive,
+            with_price=not no_price,
+            profile=profile,
+        )
+    elif group_by == "day" or from_archive:
+        by_day = rescore_symbol_by_day if from_archive else score_symbol_by_day
+        if profile:
+            by_day = functools.partial(profiled, by_day)
+        results = by_day(
+            symbol, start_date, end_date, record_users=record_users, with_price=not no_price
+        )
+        for result in results:
+            print(json.dumps(result))
+    elif prefetch:
+        score = async_score_symbol
+        if profile:
+            score = functools.partial(async_profiled, async_score_symbol)
+        result = asyncio.run(
+            score(
+                symbol,
+                start_date,
+                end_date,
+                record_users=record_users,
+                with_price=not no_price,
+                prefetch=prefetch,
+            )
+        )
+        print(json.dumps(result))
+        results = [result]
+    else:
+        score = functools.partial(profiled, score_symbol) if profile else score_symbol
+        result = score(
+            symbol, start_date, end_date, record_users=record_users, with_price=not no_price
+        )
+        print(json.dumps(result))
+        results = [result]
 
-    result = {**comment_result, **price_result}
-    result["symbol"] = symbol
-    result["start_date"] = start_date
-    result["end_date"] = end_date
-    result["processing_start_time"] = processing_start_time
-    result["processing_end_time"] = int(time.time())
+    if prometheus_file:
+        with open(prometheus_file, "w") as f:
+            f.write(metrics_to_prometheus(results))
 
-    print(json.dumps(result))
+    return results
+
+
+@main.command()
+@click.option("--symbols", default="", help="Comma separated list of symbols to backfill")
+@click.option("--symbols_file", default="", help="File with one symbol per line to backfill")
+@click.option("--start_date", required=True, help="First day to backfill %Y-%m-%d")
+@click.option("--end_date", required=True, help="Last day to backfill %Y-%m-%d")
+@click.option("--workers", default=os.cpu_count(), help="Number of worker processes")
+@click.option("--shard_days", default=DEFAULT_SHARD_DAYS, help="Max consecutive days of one symbol per work unit")
+@click.option("--checkpoint", default="backfill.checkpoint", help="File recording the finished symbol/day cells")
+@click.option("--output", default="-", type=click.File("a"), help="File the results are appended to; - for stdout")
+@click.option("--record_users", default=False, help="If True record the user ids of bulls and bears")
+@click.option("--no_price", default=False, is_flag=True, help="Skip the yahoo finance price lookup")
+def backfill(
+    symbols,
+    symbols_file,
+    start_date,
+    end_date,
+    workers,
+    shard_days,
+    checkpoint,
+    output,
+    record_users,
+    no_price,
+):
+    """Score every symbol and day of a date range, resuming from the checkpoint."""
+    symbols = parse_symbols(symbols, symbols_file)
+    if not symbols:
+        raise click.UsageError("backfill needs --symbols or --symbols_file")
+
+    def emit(line):
+        output.write(line + "\n")
+        output.flush()
+
+    return run_backfill(
+        symbols,
+        get_start_of_day(start_date),
+        get_end_of_day(end_date),
+        checkpoint,
+        workers=workers,
+        shard_days=shard_days,
+        record_users=record_users,
+        with_price=not no_price,
+        emit=emit,
+    )
+
+
+@main.command()
+@click.option("--symbol", required=True, help="Symbol whose users to list")
+@click.option("--top", default=20, help="Number of users to list")
+def users(symbol, top):
+    """List the most active users of a symbol from the user index in --cache_db."""
+    if cache_db.deferred:
+        raise click.UsageError("users needs --cache_db")
+    try:
+        stats = top_users(symbol.upper(), top)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for stat in stats:
+        click.echo(json.dumps(stat))
+    return stats
+
+
+@main.command()
+@click.option("--symbols", default="", help="Comma separated list of symbols; if blank every cached symbol")
+@click.option("--symbols_file", default="", help="File with one symbol per line")
+@click.option("--top", default=20, help="Number of cross-posting users to list")
+@click.option("--min_symbols", default=2, help="Only list users posting on at least this many symbols")
+def overlap(symbols, symbols_file, top, min_symbols):
+    """Report the users posting across symbols and each symbol's crowd overlap,
+    from the user index in --cache_db."""
+    if cache_db.deferred:
+        raise click.UsageError("overlap needs --cache_db")
+    graph = build_user_graph(parse_symbols(symbols, symbols_file) or None)
+    lines = graph.cross_posters(top, min_symbols) + graph.crowd_overlap()
+    for line in lines:
+        click.echo(json.dumps(line))
+    return lines
+
+
+@main.command()
+@click.option("--symbols", default="", help="Comma separated list of symbols to query")
+@click.option("--symbols_file", default="", help="File with one symbol per line to query")
+@click.option("--start_date", required=True, help="First day %Y-%m-%d")
+@click.option("--end_date", default="", help="Last day %Y-%m-%d; if blank use today")
+@click.option("--fields", default="", help="Comma separated result fields to print, e.g. score,current_price; if blank all")
+@click.option("--concurrency", default=DEFAULT_CONCURRENCY, help="Number of missing shards scored at once")
+@click.option("--record_users", default=False, help="If True record the user ids of bulls and bears")
+@click.option("--no_price", default=False, is_flag=True, help="Skip the yahoo finance price lookup")
+def query(symbols, symbols_file, start_date, end_date, fields, concurrency, record_users, no_price):
+    """Print one result per symbol and day from the results stored in --cache_db,
+    scoring only the missing days."""
+    if cache_db.deferred:
+        raise click.UsageError("query needs --cache_db")
+    symbols = parse_symbols(symbols, symbols_file)
+    if not symbols:
+        raise click.UsageError("query needs --symbols or --symbols_file")
+
+    results = query_results(
+        symbols,
+        get_start_of_day(start_date),
+        get_end_of_day(end_date),
+        record_users=record_users,
+        with_price=not no_price,
+        concurrency=concurrency,
+    )
+    fields = [field.strip() for field in fields.split(",") if field.strip()]
+    for result in results:
+        if fields and "error" not in result:
+            date = datetime.fromtimestamp(result["start_date"]).strftime("%Y-%m-%d")
+            result = {
+                "symbol": result["symbol"],
+                "date": date,
+                **{field: result.get(field) for field in fields},
+            }
+        click.echo(json.dumps(result))
+    return results
 
-    return result
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,12 @@
 import pytest
+import click
 from unittest.mock import patch, MagicMock
 from datetime import datetime, timedelta
 import requests
 from bs4 import BeautifulSoup as bs
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from src import get_yahoo_comments as gyc 
 # functions tested
@@ -12,6 +15,33 @@ from src import get_yahoo_comments as gyc
 # gyc.get_stock_info
 # gyc.score_comments
 # gyc.get_conversation_info
+# gyc.parse_symbols
+# gyc.score_symbols
+# gyc.score_comments_by_day
+# gyc.get_stock_info_by_day
+# gyc.get_comment_data (with the local cache)
+# gyc.iter_comments
+# gyc.seek_offset
+# gyc.configure_http / gyc._http_post
+# gyc.aiter_comments / gyc.async_score_symbols
+# gyc.get_cached_conversation_info / gyc._with_conversation
+# gyc.score_comments_vectorized / gyc.score_columns
+# gyc.prefetch_prices
+# gyc.SymbolWatch / gyc.watch
+# gyc.parse_windows / gyc.SlidingWindow / gyc.WindowedSentiment
+# gyc.write_archive / gyc.load_archive / gyc.archive_days / gyc.rescore_archive
+# gyc.plan_backfill / gyc.read_checkpoint / gyc.run_backfill / backfill command
+# lazy imports / --no_price
+# gyc.profiled / gyc.async_profiled / gyc.metrics_to_prometheus
+# gyc.YAHOO_BASE_URL / gyc.SPOTIM_BASE_URL
+# gyc._get_comments_block projection / gyc.set_page_size
+# unique users / gyc.set_max_user_weight / gyc.UserStat / gyc.top_users
+# gyc.build_user_graph / gyc.UserGraph
+# gyc.DailyResult / gyc.query_results
+# gyc.set_reply_expansion / gyc.get_replies / reply expansion in gyc.iter_comments
+# page pruning in gyc.iter_comments / gyc.aiter_comments
+# gyc.set_fetch_workers / sharded page fetch in gyc.iter_comments
+# gyc.Comment
 
 def test_get_start_of_day_no_date():
     # Get the current date and calculate expected start-of-day timestamp
@@ -244,6 +274,9 @@ def test_score_comments_all_bullish():
         "score": 2,
         "oldest_comment_ts": "2023-11-23 16:20:00",
         "newest_comment_ts": "2023-11-24 16:20:00",
+        "unique_users": 0,
+        "unique_bulls": 0,
+        "unique_bears": 0,
     }
     assert result == expected, f"Expected {expected}, got {result}"
 
@@ -265,6 +298,9 @@ def test_score_comments_all_bearish():
         "score": -2,
         "oldest_comment_ts": "2023-11-23 16:20:00",
         "newest_comment_ts": "2023-11-24 16:20:00",
+        "unique_users": 0,
+        "unique_bulls": 0,
+        "unique_bears": 0,
     }
     assert result == expected, f"Expected {expected}, got {result}"
 
@@ -287,6 +323,9 @@ def test_score_comments_mixed_labels():
         "score": 0,
         "oldest_comment_ts": "2023-11-23 16:20:00",
         "newest_comment_ts": "2023-11-25 16:20:00",
+        "unique_users": 0,
+        "unique_bulls": 0,
+        "unique_bears": 0,
     }
     assert result == expected, f"Expected {expected}, got {result}"
 
@@ -309,6 +348,9 @@ def test_score_comments_missing_labels():
         "score": 1,
         "oldest_comment_ts": "2023-11-23 16:20:00",
         "newest_comment_ts": "2023-11-25 16:20:00",
+        "unique_users": 0,
+        "unique_bulls": 0,
+        "unique_bears": 0,
     }
     assert result == expected, f"Expected {expected}, got {result}"
 
@@ -327,6 +369,9 @@ def test_score_comments_empty_input():
         "score": 0,
         "oldest_comment_ts": None,
         "newest_comment_ts": None,
+        "unique_users": 0,
+        "unique_bulls": 0,
+        "unique_bears": 0,
     }
     assert result == expected, f"Expected {expected}, got {result}"
 
@@ -364,8 +409,8 @@ def test_get_conversation_info_valid_symbol():
         </body>
     </html>
     """
-    # Mock the requests.get call
-    with patch('src.get_yahoo_comments.requests.get') as mock_get:
+    # Mock the HTTP GET call
+    with patch('src.get_yahoo_comments._http_get') as mock_get:
         mock_response = MagicMock()
         mock_response.text = mock_html
         mock_get.return_value = mock_response
@@ -391,8 +436,8 @@ def test_get_conversation_info_valid_symbol():
 #         </body>
 #     </html>
 #     """
-#     # Mock the requests.get call
-#     with patch('src.get_yahoo_comments.requests.get') as mock_get:
+#     # Mock the HTTP GET call
+#     with patch('src.get_yahoo_comments._http_get') as mock_get:
 #         mock_response = MagicMock()
 #         mock_response.text = mock_html
 #         mock_get.return_value = mock_response
@@ -414,8 +459,8 @@ def test_get_conversation_info_malformed_json():
         </body>
     </html>
     """
-    # Mock the requests.get call
-    with patch('src.get_yahoo_comments.requests.get') as mock_get:
+    # Mock the HTTP GET call
+    with patch('src.get_yahoo_comments._http_get') as mock_get:
         mock_response = MagicMock()
         mock_response.text = mock_html
         mock_get.return_value = mock_response
@@ -427,8 +472,8 @@ def test_get_conversation_info_malformed_json():
 
 def test_get_conversation_info_http_error():
     """Test when the HTTP request fails."""
-    # Mock the requests.get call to raise an HTTP error
-    with patch('src.get_yahoo_comments.requests.get') as mock_get:
+    # Mock the HTTP GET call to raise an HTTP error
+    with patch('src.get_yahoo_comments._http_get') as mock_get:
         mock_get.side_effect = requests.exceptions.RequestException("HTTP error occurred")
 
         # Call the function and expect a RequestException
@@ -440,8 +485,8 @@ def test_get_conversation_info_http_error():
 #     """Test with an empty HTML response."""
 #     # Mock an empty HTML response
 #     mock_html = ""
-#     # Mock the requests.get call
-#     with patch('src.get_yahoo_comments.requests.get') as mock_get:
+#     # Mock the HTTP GET call
+#     with patch('src.get_yahoo_comments._http_get') as mock_get:
 #         mock_response = MagicMock()
 #         mock_response.text = mock_html
 #         mock_get.return_value = mock_response
@@ -449,3 +494,1393 @@ def test_get_conversation_info_http_error():
 #         # Call the function and expect an AttributeError
 #         with pytest.raises(AttributeError, match="NoneType object has no attribute 'get_text'"):
 #             gyc.get_conversation_info('AAPL')
+
+
+def test_parse_symbols_string_and_file(tmp_path):
+    """Test symbols merged from the --symbols string and a symbols file."""
+    symbols_file = tmp_path / "watchlist.txt"
+    symbols_file.write_text("aapl\n# a comment line\n\nMSFT  # trailing comment\nQBTS\n")
+
+    result = gyc.parse_symbols("QBTS, tsla,", str(symbols_file))
+
+    assert result == ["QBTS", "TSLA", "AAPL", "MSFT"], f"Got {result}"
+
+
+def test_score_symbols_emits_one_line_per_symbol():
+    """Test batch mode emits a JSON line per symbol, including failures."""
+    def fake_score_symbol(symbol, start_date, end_date, record_users, with_price=True):
+        if symbol == "BAD":
+            raise ValueError("no spotim config")
+        return {"symbol": symbol, "score": 1}
+
+    lines = []
+    with patch('src.get_yahoo_comments.score_symbol', side_effect=fake_score_symbol):
+        results = gyc.score_symbols(["AAPL", "BAD", "MSFT"], 0, 1, concurrency=2, emit=lines.append)
+
+    assert len(lines) == 3
+    assert sorted(json.loads(line)["symbol"] for line in lines) == ["AAPL", "BAD", "MSFT"]
+    errors = [r for r in results if "error" in r]
+    assert errors == [{"symbol": "BAD", "error": "no spotim config"}]
+
+
+def test_score_comments_by_day_buckets_in_one_pass():
+    """Test comments are bucketed per calendar day, including empty days."""
+    day1 = gyc.get_start_of_day("2024-11-18")
+    day3 = gyc.get_start_of_day("2024-11-20")
+    comments_data = [
+        {"additional_data": {"labels": {"ids": ["BULLISH"]}}, "time": day3 + 3600, "user_id": "u_a"},
+        {"additional_data": {"labels": {"ids": ["BEARISH"]}}, "time": day1 + 7200, "user_id": "u_b"},
+        {"additional_data": {"labels": {"ids": []}}, "time": day1 + 3600, "user_id": "u_c"},
+    ]
+
+    result = gyc.score_comments_by_day(
+        comments_data, day1, gyc.get_end_of_day("2024-11-20"), record_users=True
+    )
+
+    assert list(result.keys()) == ["2024-11-18", "2024-11-19", "2024-11-20"]
+    assert result["2024-11-18"]["bears"] == 1
+    assert result["2024-11-18"]["neutral"] == 1
+    assert result["2024-11-18"]["bear_users"] == ["u_b"]
+    assert result["2024-11-19"] == gyc.score_comments([])
+    assert result["2024-11-20"]["score"] == 1
+
+
+def test_get_stock_info_by_day_single_history_call():
+    """Test a multi-day range only downloads price history once."""
+    import pandas as pd
+
+    history = pd.DataFrame(
+        {"Open": [1.0, 2.0], "High": [1.5, 2.5], "Low": [0.5, 1.5], "Close": [1.2, 2.2], "Volume": [10, 20]},
+        index=pd.DatetimeIndex(["2024-11-18", "2024-11-19"]),
+    )
+    with patch('src.get_yahoo_comments.yf.Ticker') as MockTicker:
+        MockTicker.return_value.history.return_value = history
+
+        result = gyc.get_stock_info_by_day("AAPL", ["2024-11-18", "2024-11-19", "2024-11-20"])
+
+    MockTicker.return_value.history.assert_called_once_with(start="2024-11-18", end="2024-11-21")
+    assert result["2024-11-19"]["current_price"] == 2.2
+    assert result["2024-11-18"]["previous_close"] == 1.0
+    assert result["2024-11-20"] == {"error": "No data found for AAPL on 2024-11-20"}
+
+
+CONVERSATION_INFO = {"spotId": "sp_test", "uuid": "abc_123"}
+
+
+def make_comments(count, newest_time, step=60, prefix="c"):
+    """Builds count synthetic comments, newest first, step seconds apart."""
+    return [
+        {
+            "id": f"{prefix}{i}",
+            "time": newest_time - i * step,
+            "user_id": f"u_{i % 7}",
+            "additional_data": {"labels": {"ids": ["BULLISH"] if i % 3 == 0 else []}},
+        }
+        for i in range(count)
+    ]
+
+
+class FakeCommentStream:
+    """Stands in for _get_comments_block over an in-memory, newest first comment list."""
+
+    def __init__(self, comments):
+        self.comments = comments
+        self.offsets = []
+
+    def __call__(self, conversation_info, offset, *args, **kwargs):
+        self.offsets.append(offset)
+        page = self.comments[offset:offset + gyc.PAGE_SIZE]
+        return {"comments": page, "has_next": offset + gyc.PAGE_SIZE < len(self.comments)}
+
+
+@pytest.fixture
+def comment_cache(tmp_path):
+    gyc.open_cache(str(tmp_path / "cache.db"))
+    yield
+    gyc.close_cache()
+
+
+def test_get_comment_data_cache_serves_repeat_ranges_locally(comment_cache):
+    """Test a cached range is served without any further requests."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(350, now))
+    start_date, end_date = now - 250 * 60, now - 150 * 60
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        first = gyc.get_comment_data(CONVERSATION_INFO, start_date, end_date, offset=0)
+        requests_made = len(stream.offsets)
+        second = gyc.get_comment_data(CONVERSATION_INFO, start_date, end_date, offset=0)
+
+    assert requests_made == 3
+    assert len(stream.offsets) == requests_made
+    assert [c["id"] for c in second] == [c["id"] for c in first]
+    assert len(first) == 101
+    assert first[0]["time"] == end_date
+
+
+def test_get_comment_data_cache_incremental_refresh(comment_cache):
+    """Test only new pages are fetched when the stream grows, and older ranges extend the cache."""
+    now = 1732500000
+    old_comments = make_comments(250, now)
+    stream = FakeCommentStream(old_comments)
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        gyc.get_comment_data(CONVERSATION_INFO, now - 120 * 60, now + 3600, offset=0)
+        assert stream.offsets == [0, 100]
+
+        # 30 new comments arrive, then ask for everything since the very first comment
+        stream.comments = make_comments(30, now + 30 * 60, prefix="n") + old_comments
+        stream.offsets = []
+        result = gyc.get_comment_data(CONVERSATION_INFO, now - 400 * 60, now + 3600, offset=0)
+
+    assert stream.offsets[0] == 0
+    assert 100 not in stream.offsets[1:]
+    assert len(result) == 280
+    assert len({c["id"] for c in result}) == 280
+    assert gyc.CrawlState.get().complete
+
+
+def test_iter_comments_streams_pages_lazily():
+    """Test pages are only requested as the consumer reaches them."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(500, now))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        comments = gyc.iter_comments(CONVERSATION_INFO, now - 10_000 * 60, now, seek=False)
+        first = [next(comments) for _ in range(100)]
+        assert stream.offsets == [0]
+        next(comments)
+        assert stream.offsets == [0, 100]
+
+    assert first[0]["time"] == now
+
+
+def test_iter_comments_stops_at_start_date():
+    """Test paging stops at the first page ending before start_date."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(1000, now))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        result = list(
+            gyc.iter_comments(CONVERSATION_INFO, now - 150 * 60, now - 50 * 60, seek=False)
+        )
+
+    assert stream.offsets == [0, 100]
+    assert len(result) == 101
+
+
+def test_get_comment_data_deep_history_does_not_recurse():
+    """Test histories deeper than the recursion limit are paged iteratively."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(150_000, now, step=1))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        result = gyc.get_comment_data(CONVERSATION_INFO, 0, now)
+
+    # every page once, the first one fetched by the seek probe
+    assert len(stream.offsets) == 1500
+    assert len(result) == 150_000
+
+
+def test_seek_offset_uses_logarithmic_requests():
+    """Test seeking deep into the history probes O(log n) pages."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(100_000, now))
+    end_date = now - 77_777 * 60
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        offset = gyc.seek_offset(CONVERSATION_INFO, end_date)
+
+    assert 77_777 - gyc.PAGE_SIZE <= offset <= 77_777
+    assert len(stream.offsets) < 30
+
+
+def test_seek_offset_recent_end_date():
+    """Test an end_date covered by the first page needs a single request."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(1000, now))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        assert gyc.seek_offset(CONVERSATION_INFO, now + 3600) == 0
+        assert gyc.seek_offset(CONVERSATION_INFO, now - 30 * 60) == 30
+
+    assert stream.offsets == [0, 0]
+
+
+def test_iter_comments_reuses_the_page_fetched_by_the_seek():
+    """Test the page a seek probe fetched is not requested again by the pager."""
+    import asyncio
+
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(1000, now))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        today = list(gyc.iter_comments(CONVERSATION_INFO, now - 50 * 60, now))
+        assert stream.offsets == [0]
+        stream.offsets = []
+        straddling = list(gyc.iter_comments(CONVERSATION_INFO, now - 150 * 60, now - 130 * 60))
+        assert stream.offsets == [0, 100]
+        stream.offsets = []
+        asyncio.run(_collect(gyc.aiter_comments(CONVERSATION_INFO, now - 150 * 60, now - 130 * 60)))
+        assert stream.offsets[:2] == [0, 100] and 130 not in stream.offsets
+
+    assert [c["id"] for c in today] == [f"c{i}" for i in range(51)]
+    assert [c["id"] for c in straddling] == [f"c{i}" for i in range(130, 151)]
+
+
+def test_iter_comments_with_seek_matches_linear_scan():
+    """Test seeking returns the same comments as paging from offset 0."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(20_000, now))
+    start_date, end_date = now - 15_000 * 60, now - 14_000 * 60
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        linear = list(gyc.iter_comments(CONVERSATION_INFO, start_date, end_date, seek=False))
+        linear_requests = len(stream.offsets)
+        stream.offsets = []
+        seeked = list(gyc.iter_comments(CONVERSATION_INFO, start_date, end_date))
+
+    assert [c["id"] for c in seeked] == [c["id"] for c in linear]
+    assert len(stream.offsets) < linear_requests / 5
+
+
+@pytest.fixture
+def http_settings():
+    saved = dict(gyc.HTTP_SETTINGS)
+    yield
+    gyc.configure_http(**saved)
+
+
+def test_configure_http_shared_session_with_retries(http_settings):
+    """Test one keep-alive session is reused and carries the retry policy."""
+    gyc.configure_http(retries=5, backoff=0.25, pool_size=16)
+
+    session = gyc._get_session()
+    assert gyc._get_session() is session
+
+    retry = session.get_adapter("https://api-2-0.spot.im").max_retries
+    assert retry.total == 5
+    assert retry.backoff_jitter == 0.25
+    assert 429 in retry.status_forcelist
+    assert retry.is_retry("POST", 503)
+
+
+def test_rate_limiter_spaces_requests():
+    """Test the per-host rate limiter spaces out back to back calls."""
+    limiter = gyc._RateLimiter(10)
+    with patch('src.get_yahoo_comments.time.monotonic', return_value=100.0), \
+            patch('src.get_yahoo_comments.time.sleep') as mock_sleep:
+        for _ in range(3):
+            limiter.wait()
+
+    assert [round(c.args[0], 3) for c in mock_sleep.call_args_list] == [0.1, 0.2]
+
+
+def test_http_post_retries_server_errors(http_settings):
+    """Test a 503 from the server is retried on the shared session."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    import threading
+
+    statuses = [503, 200]
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            status = statuses.pop(0)
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        gyc.configure_http(retries=2, backoff=0)
+        response = gyc._http_post(f"http://127.0.0.1:{server.server_port}/", data="{}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert response.status_code == 200
+    assert statuses == []
+
+
+def test_get_comments_block_error_response():
+    """Test an error payload from spot.im raises a ValueError instead of a KeyError."""
+    with patch('src.get_yahoo_comments._http_post') as mock_post:
+        mock_post.return_value.content = b'{"error": "rate limited"}'
+
+        with pytest.raises(ValueError, match="No conversation in spot.im response"):
+            gyc._get_comments_block(CONVERSATION_INFO, 0)
+
+
+async def _collect(async_iterable):
+    return [item async for item in async_iterable]
+
+
+def test_aiter_comments_matches_iter_comments():
+    """Test the async engine yields the same comments as the sync pager."""
+    import asyncio
+
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(2000, now))
+    start_date, end_date = now - 1500 * 60, now - 300 * 60
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        expected = list(gyc.iter_comments(CONVERSATION_INFO, start_date, end_date))
+        result = asyncio.run(
+            _collect(gyc.aiter_comments(CONVERSATION_INFO, start_date, end_date, prefetch=3))
+        )
+
+    assert [c["id"] for c in result] == [c["id"] for c in expected]
+
+
+def test_aiter_comments_bounds_prefetch_past_start_date():
+    """Test speculative requests stop at prefetch pages past the start_date boundary."""
+    import asyncio
+
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(5000, now))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        result = asyncio.run(
+            _collect(gyc.aiter_comments(CONVERSATION_INFO, now - 250 * 60, now, seek=False, prefetch=4))
+        )
+
+    assert len(result) == 251
+    assert max(stream.offsets) <= 200 + 4 * gyc.PAGE_SIZE
+
+
+def test_aiter_comments_realigns_after_short_page():
+    """Test a short page re-bases the speculative offsets so no comment is skipped."""
+    import asyncio
+
+    now = 1732500000
+    comments = make_comments(400, now)
+
+    def short_first_page(conversation_info, offset, *args, **kwargs):
+        size = 60 if offset == 0 else gyc.PAGE_SIZE
+        page = comments[offset:offset + size]
+        return {"comments": page, "has_next": offset + size < len(comments)}
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=short_first_page):
+        result = asyncio.run(
+            _collect(gyc.aiter_comments(CONVERSATION_INFO, 0, now, seek=False, prefetch=3))
+        )
+
+    assert [c["id"] for c in result] == [c["id"] for c in comments]
+
+
+def test_async_score_symbols_one_line_per_symbol():
+    """Test the async batch runs every symbol on one event loop."""
+    import asyncio
+
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(300, now))
+
+    lines = []
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream), \
+            patch('src.get_yahoo_comments.get_conversation_info', return_value=CONVERSATION_INFO), \
+            patch('src.get_yahoo_comments.get_stock_info', return_value={"current_price": 1.0}):
+        results = asyncio.run(
+            gyc.async_score_symbols(["AAPL", "MSFT"], now - 3600, now, concurrency=2, emit=lines.append)
+        )
+
+    assert len(lines) == 2
+    assert {r["symbol"] for r in results} == {"AAPL", "MSFT"}
+    assert all(r["bulls"] + r["neutral"] == 61 for r in results)
+
+
+def test_get_conversation_info_unquoted_id_falls_back_to_html_parser():
+    """Test markup the fast regex does not match is still parsed."""
+    mock_html = '<html><body><script id=spotim-config>{"config": {"spotId": "sp_x"}}</script></body></html>'
+    with patch('src.get_yahoo_comments._http_get') as mock_get:
+        mock_get.return_value.text = mock_html
+
+        assert gyc.get_conversation_info('AAPL') == {"spotId": "sp_x"}
+
+
+def test_get_conversation_info_missing_config():
+    """Test a page without spotim-config raises a friendly error."""
+    with patch('src.get_yahoo_comments._http_get') as mock_get:
+        mock_get.return_value.text = "<html><body><div>No relevant script here</div></body></html>"
+
+        with pytest.raises(ValueError, match="No spotim-config found on the community page of INVALID"):
+            gyc.get_conversation_info('INVALID')
+
+
+def test_conversation_config_cache_and_invalidation(comment_cache):
+    """Test the scraped config is reused, expires and is dropped when the API rejects it."""
+    mock_html = '<script id="spotim-config">{"config": {"spotId": "sp_new", "uuid": "u_1"}}</script>'
+    with patch('src.get_yahoo_comments._http_get') as mock_get:
+        mock_get.return_value.text = mock_html
+        gyc.get_conversation_info('AAPL')
+
+        assert gyc.get_cached_conversation_info('AAPL') == {"spotId": "sp_new", "uuid": "u_1"}
+        with patch('src.get_yahoo_comments.time.time', return_value=time.time() + gyc.CONVERSATION_TTL + 1):
+            assert gyc.get_cached_conversation_info('AAPL') is None
+
+        gyc.ConversationConfig.update(config='{"spotId": "sp_stale", "uuid": "u_0"}').execute()
+        seen = []
+
+        def fetch(conversation_info):
+            seen.append(conversation_info["spotId"])
+            if conversation_info["spotId"] == "sp_stale":
+                raise ValueError("No conversation in spot.im response")
+            return "scored"
+
+        assert gyc._with_conversation('AAPL', fetch) == "scored"
+        assert seen == ["sp_stale", "sp_new"]
+        assert mock_get.call_count == 2
+
+
+@pytest.mark.parametrize("comments_data", [
+    [],
+    [{"time": 1700947200}],
+    [
+        {"additional_data": {"labels": {"ids": ["BEARISH"]}}, "time": 1700774400, "user_id": "u_1"},
+        {"additional_data": {"labels": {"ids": ["BULLISH", "BEARISH"]}}, "time": 1700860800, "user_id": "u_2"},
+        {"additional_data": {"labels": {}}, "time": 1700947200, "user_id": "u_3"},
+        {"additional_data": {"labels": {"ids": ["BULLISH"]}}, "time": 1700700000, "user_id": "u_1"},
+        {"additional_data": {"labels": {"ids": ["BULLISH"]}}, "time": 1700700001, "user_id": ""},
+    ],
+    make_comments(1000, 1732500000),
+])
+def test_score_comments_vectorized_matches_loop(comments_data):
+    """Test the columnar scorer returns exactly the loop scorer's result."""
+    for record_users in (False, True):
+        expected = gyc.score_comments(comments_data, record_users=record_users)
+        result = gyc.score_comments_vectorized(comments_data, record_users=record_users)
+        assert result == expected, f"Expected {expected}, got {result}"
+
+
+def _bulk_download_frame(symbols, days):
+    import pandas as pd
+
+    fields = ["Open", "High", "Low", "Close", "Volume"]
+    columns = pd.MultiIndex.from_product([symbols, fields])
+    data = [[i + 1.0, i + 2.0, i + 0.5, i + 1.5, 1000.0 * (i + 1)] * len(symbols) for i in range(len(days))]
+    return pd.DataFrame(data, index=pd.DatetimeIndex(days), columns=columns)
+
+
+def test_prefetch_prices_single_bulk_download(comment_cache):
+    """Test a watchlist and date range is downloaded once and then served from the cache."""
+    days = ["2024-11-18", "2024-11-19", "2024-11-20"]
+    frame = _bulk_download_frame(["AAPL", "MSFT"], days[:2])
+
+    with patch('src.get_yahoo_comments.yf.download', return_value=frame) as mock_download, \
+            patch('src.get_yahoo_comments.yf.Ticker') as MockTicker:
+        gyc.prefetch_prices(["AAPL", "MSFT"], days)
+        gyc.prefetch_prices(["AAPL", "MSFT"], days)
+
+        result = gyc.get_stock_info_by_day("MSFT", days)
+
+    mock_download.assert_called_once()
+    assert mock_download.call_args.args[0] == ["AAPL", "MSFT"]
+    assert mock_download.call_args.kwargs["start"] == "2024-11-18"
+    assert mock_download.call_args.kwargs["end"] == "2024-11-21"
+    MockTicker.assert_not_called()
+    assert result["2024-11-19"] == {
+        "current_price": 2.5, "day_low": 1.5, "day_high": 3.0, "volume": 2000, "previous_close": 2.0,
+    }
+    assert result["2024-11-20"] == {"error": "No data found for MSFT on 2024-11-20"}
+
+
+def test_prefetch_prices_only_fetches_missing_days(comment_cache):
+    """Test only the uncached (symbol, day) cells trigger a download."""
+    with patch('src.get_yahoo_comments.yf.download') as mock_download:
+        mock_download.return_value = _bulk_download_frame(["AAPL"], ["2024-11-18"])
+        gyc.prefetch_prices(["AAPL"], ["2024-11-18"])
+
+        mock_download.return_value = _bulk_download_frame(["AAPL", "MSFT"], ["2024-11-18", "2024-11-19"])
+        gyc.prefetch_prices(["AAPL", "MSFT"], ["2024-11-18", "2024-11-19"])
+
+    assert mock_download.call_count == 2
+    assert mock_download.call_args.args[0] == ["AAPL", "MSFT"]
+    assert gyc.PriceBar.select().count() == 4
+
+
+def test_prefetch_prices_caches_nothing_from_a_failed_download(comment_cache):
+    """Test an empty or partial download leaves the missing cells to be downloaded again."""
+    import pandas as pd
+
+    days = ["2024-11-18", "2024-11-19"]
+    partial = _bulk_download_frame(["AAPL", "MSFT"], days)
+    partial["MSFT"] = float("nan")  # how yf.download reports one failed ticker of many
+
+    with patch('src.get_yahoo_comments.yf.download') as mock_download:
+        mock_download.return_value = pd.DataFrame()
+        gyc.prefetch_prices(["AAPL"], days)
+        assert gyc.PriceBar.select().count() == 0
+
+        mock_download.return_value = partial
+        gyc.prefetch_prices(["AAPL", "MSFT"], days)
+        assert gyc.get_stock_info_by_day("AAPL", days)["2024-11-19"]["current_price"] == 2.5
+
+        mock_download.return_value = _bulk_download_frame(["MSFT"], days)
+        gyc.prefetch_prices(["AAPL", "MSFT"], days)
+
+    assert mock_download.call_count == 3
+    assert mock_download.call_args.args[0] == ["MSFT"]
+    assert gyc.PriceBar.select().where(gyc.PriceBar.close.is_null()).count() == 0
+    assert gyc.PriceBar.select().count() == 4
+
+
+def test_symbol_watch_only_scores_new_comments():
+    """Test each poll fetches and scores only the comments posted since the last one."""
+    day_start = gyc.get_start_of_day()
+    comments = make_comments(250, day_start + 3000)
+    stream = FakeCommentStream(list(comments))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream), \
+            patch('src.get_yahoo_comments.get_conversation_info', return_value=CONVERSATION_INFO):
+        symbol_watch = gyc.SymbolWatch("QBTS")
+        first = symbol_watch.poll()
+
+        # two new comments, one in the same second as the newest one already seen
+        stream.comments = [
+            {"id": "n1", "time": day_start + 3100, "additional_data": {"labels": {"ids": ["BEARISH"]}}},
+            {"id": "n0", "time": day_start + 3000, "additional_data": {"labels": {"ids": ["BULLISH"]}}},
+        ] + comments
+        stream.offsets = []
+        second = symbol_watch.poll()
+        third = symbol_watch.poll()
+
+    assert first["new_comments"] == 51
+    assert second["new_comments"] == 2
+    assert stream.offsets == [0, 0]
+    assert second["delta"]["bears"] == 1 and second["delta"]["bulls"] == 1
+    assert second["totals"]["bulls"] == first["totals"]["bulls"] + 1
+    assert third["new_comments"] == 0
+    assert third["totals"] == second["totals"]
+
+
+def test_symbol_watch_drops_a_stale_conversation_config(comment_cache):
+    """Test a poll rejected by spot.im invalidates the cached config so the next one scrapes it."""
+    gyc.ConversationConfig.create(symbol="QBTS", config='{"spotId": "sp_stale", "uuid": "u_0"}',
+                                  fetched_at=int(time.time()))
+    seen = []
+
+    def fetch(conversation_info, last_time, last_ids):
+        seen.append(conversation_info["spotId"])
+        if conversation_info["spotId"] == "sp_stale":
+            raise ValueError("No conversation in spot.im response")
+        return []
+
+    symbol_watch = gyc.SymbolWatch("QBTS")
+    with patch('src.get_yahoo_comments.fetch_new_comments', side_effect=fetch), \
+            patch('src.get_yahoo_comments.get_conversation_info', return_value=CONVERSATION_INFO):
+        with pytest.raises(ValueError):
+            symbol_watch.poll()
+        assert gyc.get_cached_conversation_info("QBTS") is None
+        assert symbol_watch.poll()["new_comments"] == 0
+
+    assert seen == ["sp_stale", CONVERSATION_INFO["spotId"]]
+
+
+def test_watch_emits_per_tick_and_survives_errors():
+    """Test watch emits one line per symbol per tick and keeps going after an error."""
+    polls = []
+
+    def fake_poll(self):
+        polls.append(self.symbol)
+        if self.symbol == "BAD":
+            raise ValueError("boom")
+        return {"symbol": self.symbol, "new_comments": 0}
+
+    lines = []
+    with patch.object(gyc.SymbolWatch, 'poll', fake_poll), \
+            patch('src.get_yahoo_comments.time.sleep') as mock_sleep:
+        gyc.watch(["QBTS", "BAD"], 60, ticks=3, emit=lines.append)
+
+    assert len(lines) == 6
+    assert json.loads(lines[1]) == {"symbol": "BAD", "error": "boom"}
+    assert mock_sleep.call_count == 2
+
+
+def test_parse_windows():
+    """Test window lengths are parsed to seconds, in order."""
+    assert gyc.parse_windows("15m, 1h,4h,24h,30s,2d") == {
+        "15m": 900, "1h": 3600, "4h": 14400, "24h": 86400, "30s": 30, "2d": 172800,
+    }
+    assert gyc.parse_windows("") == {}
+    with pytest.raises(ValueError, match="Invalid window: 15x"):
+        gyc.parse_windows("15x")
+
+
+def test_sliding_window_evicts_old_comments():
+    """Test counts drop as comments fall out of the window."""
+    window = gyc.SlidingWindow(600)
+    window.add(1000, True, False)
+    window.add(1300, False, True)
+    window.add(1500, False, False)
+
+    window.advance(1550)
+    assert window.result() == {"bulls": 1, "bears": 1, "neutral": 1, "score": 0}
+    window.advance(1600)
+    assert window.result() == {"bulls": 0, "bears": 1, "neutral": 1, "score": -1}
+    window.advance(5000)
+    assert window.result() == {"bulls": 0, "bears": 0, "neutral": 0, "score": 0}
+    assert not window.buffer
+
+
+def test_windowed_sentiment_matches_recomputation():
+    """Test every window matches scoring its time range from scratch."""
+    now = 1732500000
+    comments = make_comments(3000, now, step=47)
+    windowed = gyc.WindowedSentiment(gyc.parse_windows("15m,1h,4h,24h"))
+
+    # fed in newest first batches, as the watch loop receives them
+    for i in range(len(comments), 0, -500):
+        windowed.add_comments(comments[max(0, i - 500):i])
+    result = windowed.result(now)
+
+    for name, width in gyc.parse_windows("15m,1h,4h,24h").items():
+        expected = gyc.score_comments([c for c in comments if c["time"] > now - width])
+        assert result[name]["bulls"] == expected["bulls"], name
+        assert result[name]["neutral"] == expected["neutral"], name
+        assert result[name]["score"] == expected["score"], name
+
+
+def test_symbol_watch_reports_windows():
+    """Test the watch line carries the sliding windows, seeded from the last 24h."""
+    now = int(time.time())
+    stream = FakeCommentStream(make_comments(2000, now, step=60))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream), \
+            patch('src.get_yahoo_comments.get_conversation_info', return_value=CONVERSATION_INFO):
+        line = gyc.SymbolWatch("QBTS", windows=gyc.parse_windows("1h,24h")).poll()
+
+    counts = line["windows"]["1h"]
+    assert counts["bulls"] + counts["neutral"] == 60
+    counts = line["windows"]["24h"]
+    assert counts["bulls"] + counts["neutral"] == 1440
+
+
+def test_main_windows_needs_watch(http_settings):
+    """Test --windows is rejected rather than ignored when --watch is not set."""
+    from click.testing import CliRunner
+
+    with patch('src.get_yahoo_comments.score_symbol') as mock_score:
+        result = CliRunner().invoke(gyc.main, ["--symbol=QBTS", "--windows=1h"])
+
+    assert result.exit_code == 2
+    assert "--windows needs --watch" in result.output
+    mock_score.assert_not_called()
+
+
+def test_archive_round_trip_is_memory_mapped(tmp_path):
+    """Test archived records keep the scoring fields and load memory-mapped."""
+    import numpy as np
+
+    comments = make_comments(500, 1732500000)
+    gyc.write_archive(str(tmp_path), "QBTS", "2024-11-24", comments)
+
+    records = gyc.load_archive(str(tmp_path), "QBTS", "2024-11-24")
+
+    assert isinstance(records, np.memmap)
+    assert records.dtype == np.dtype(gyc.ARCHIVE_FIELDS)
+    assert records["comment_id"][3] == b"c3"
+    assert gyc.load_archive(str(tmp_path), "QBTS", "2024-11-25") is None
+
+    expected = gyc.score_comments(comments, record_users=True)
+    result = gyc.score_columns(gyc.records_to_columns(records, record_users=True), record_users=True)
+    assert result == expected
+
+
+def test_archive_days_only_writes_complete_days(tmp_path):
+    """Test days still in progress are not archived and rescoring reads the rest."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    start_date, end_date = gyc.get_start_of_day(yesterday), gyc.get_end_of_day(today)
+    comments = make_comments(300, gyc.get_start_of_day(today) + 3600, step=600)
+
+    gyc.archive_days(str(tmp_path), "QBTS", comments, start_date, end_date)
+    result = gyc.rescore_archive(str(tmp_path), "QBTS", [yesterday, today])
+
+    assert result[today] is None
+    expected = gyc.score_comments(
+        [c for c in comments if start_date <= c["time"] < gyc.get_start_of_day(today)]
+    )
+    assert result[yesterday] == expected
+
+
+def test_plan_backfill_shards_missing_cells():
+    """Test missing cells are grouped into runs of consecutive days per symbol."""
+    days = ["2024-11-18", "2024-11-19", "2024-11-20", "2024-11-21", "2024-11-22"]
+    done = {("QBTS", "2024-11-20"), ("RGTI", "2024-11-18")}
+
+    shards = gyc.plan_backfill(["QBTS", "RGTI"], days, done, shard_days=3)
+
+    assert shards == [
+        ("QBTS", "2024-11-18", "2024-11-19"),
+        ("QBTS", "2024-11-21", "2024-11-22"),
+        ("RGTI", "2024-11-19", "2024-11-21"),
+        ("RGTI", "2024-11-22", "2024-11-22"),
+    ]
+
+
+def test_read_checkpoint_ignores_truncated_line(tmp_path):
+    """Test a line cut short by a crash does not break resuming."""
+    checkpoint = tmp_path / "backfill.checkpoint"
+    checkpoint.write_text('{"symbol": "QBTS", "date": "2024-11-18"}\n{"symbol": "QB')
+
+    assert gyc.read_checkpoint(str(checkpoint)) == {("QBTS", "2024-11-18")}
+    assert gyc.read_checkpoint(str(tmp_path / "missing")) == set()
+
+
+def test_run_backfill_resumes_from_checkpoint(tmp_path):
+    """Test a rerun only scores the cells a failed run did not finish."""
+    checkpoint = str(tmp_path / "backfill.checkpoint")
+    start_date, end_date = gyc.get_start_of_day("2024-11-18"), gyc.get_end_of_day("2024-11-20")
+    calls = []
+    fail = {"RGTI"}
+
+    def fake_score_symbol_by_day(symbol, start_date, end_date, record_users=False, with_price=True):
+        calls.append(symbol)
+        if symbol in fail:
+            raise ValueError("spot.im is down")
+        return [
+            {"symbol": symbol, "start_date": gyc.get_start_of_day(day), "end_date": gyc.get_end_of_day(day)}
+            for day in gyc.get_days(start_date, end_date)
+        ]
+
+    lines = []
+    with patch('src.get_yahoo_comments.score_symbol_by_day', side_effect=fake_score_symbol_by_day):
+        with pytest.raises(click.ClickException, match="1 of 2 backfill shards failed"):
+            gyc.run_backfill(["QBTS", "RGTI"], start_date, end_date, checkpoint,
+                             emit=lines.append, pool=ThreadPoolExecutor(2))
+        assert len(lines) == 3
+        assert len(gyc.read_checkpoint(checkpoint)) == 3
+
+        fail.clear()
+        calls.clear()
+        gyc.run_backfill(["QBTS", "RGTI"], start_date, end_date, checkpoint,
+                         emit=lines.append, pool=ThreadPoolExecutor(2))
+        assert calls == ["RGTI"]
+        assert len(gyc.read_checkpoint(checkpoint)) == 6
+
+        calls.clear()
+        assert gyc.run_backfill(["QBTS", "RGTI"], start_date, end_date, checkpoint, emit=lines.append) == []
+        assert calls == []
+
+
+def test_backfill_exits_non_zero_from_spawned_workers(tmp_path, monkeypatch, http_settings):
+    """Test the backfill command runs shards on spawned workers and fails when they do."""
+    from click.testing import CliRunner
+
+    # the spawned worker inherits the environment: every request is refused at once
+    monkeypatch.setenv("HTTPS_PROXY", "http://127.0.0.1:9")
+    monkeypatch.setenv("HTTP_PROXY", "http://127.0.0.1:9")
+    checkpoint = str(tmp_path / "backfill.checkpoint")
+
+    result = CliRunner().invoke(gyc.main, [
+        "--retries=0", "--timeout=2", "backfill", "--symbols=QBTS", "--start_date=2024-11-18",
+        "--end_date=2024-11-18", "--workers=1", f"--checkpoint={checkpoint}", "--no_price",
+    ])
+
+    assert result.exit_code == 1, result.output
+    assert "backfill of QBTS 2024-11-18..2024-11-18 failed" in result.stderr
+    assert "process pool" not in result.stderr  # the worker itself ran the shard
+    assert "1 of 1 backfill shards failed" in result.stderr
+    assert gyc.read_checkpoint(checkpoint) == set()
+
+
+def test_import_and_help_skip_heavy_dependencies():
+    """Test the module import and --help stay off yfinance, pandas, numpy and bs4."""
+    import os
+    import subprocess
+    import sys
+
+    script = (
+        "import sys; from click.testing import CliRunner; "
+        "from src import get_yahoo_comments as gyc; "
+        "assert CliRunner().invoke(gyc.main, ['--help']).exit_code == 0; "
+        "print(','.join(m for m in ('yfinance', 'pandas', 'numpy', 'bs4', 'requests') if m in sys.modules))"
+    )
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True, cwd=repo_root
+    )
+
+    assert output.stdout.strip() == ""
+
+
+def test_score_symbol_no_price_skips_yfinance():
+    """Test with_price=False never touches yfinance."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(50, now))
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream), \
+            patch('src.get_yahoo_comments.get_conversation_info', return_value=CONVERSATION_INFO), \
+            patch('src.get_yahoo_comments.yf.Ticker') as MockTicker:
+        result = gyc.score_symbol("QBTS", now - 3600, now, with_price=False)
+
+    MockTicker.assert_not_called()
+    assert "current_price" not in result
+    assert result["bulls"] + result["neutral"] == 50
+
+
+class FakeSession:
+    """Stands in for the shared requests session: serves a community page and the
+    pages of a FakeCommentStream, reporting one urllib3 retry per comment page."""
+
+    def __init__(self, comments):
+        self.stream = FakeCommentStream(comments)
+
+    def request(self, method, url, data=None, **kwargs):
+        if method == "GET":
+            body = {"text": '<script id="spotim-config">{"config": %s}</script>' % json.dumps(CONVERSATION_INFO)}
+            retries = []
+        else:
+            body = {"conversation": self.stream(CONVERSATION_INFO, json.loads(data)["offset"])}
+            retries = ["503"]
+        response = MagicMock()
+        response.text = body.get("text", "")
+        response.content = json.dumps(body).encode()
+        response.json.return_value = body
+        response.raw.retries.history = retries
+        return response
+
+
+def test_profiled_score_symbol_reports_stages_and_counters():
+    """Test --profile attaches per stage times and HTTP counters to the result."""
+    now = 1732500000
+    session = FakeSession(make_comments(250, now))
+
+    with patch('src.get_yahoo_comments._get_session', return_value=session), \
+            patch('src.get_yahoo_comments._get_stock_info', return_value={"current_price": 1.0}):
+        result = gyc.profiled(gyc.score_symbol, "QBTS", now - 86400, now)
+        pages = len(session.stream.offsets)
+        unprofiled = gyc.score_symbol("QBTS", now - 86400, now)
+
+    metrics = result["metrics"]
+    assert set(metrics["stages"]) == {
+        "get_conversation_info", "_get_comments_block", "score_comments", "get_stock_info"
+    }
+    assert pages >= 3
+    assert metrics["stages"]["_get_comments_block"]["calls"] == pages
+    assert len(metrics["stages"]["_get_comments_block"]["call_seconds"]) == pages
+    assert metrics["pages_fetched"] == pages
+    assert metrics["requests"] == pages + 1
+    assert metrics["retries"] == pages
+    assert metrics["bytes_downloaded"] > 0
+    assert "metrics" not in unprofiled
+
+
+def test_async_profiled_counts_pages_fetched_in_threads():
+    """Test the metrics follow the page requests the async engine runs on its executor."""
+    import asyncio
+
+    now = 1732500000
+    session = FakeSession(make_comments(250, now))
+
+    with patch('src.get_yahoo_comments._get_session', return_value=session):
+        results = asyncio.run(gyc.async_score_symbols(
+            ["AAPL", "MSFT"], now - 86400, now, with_price=False, profile=True, emit=lambda line: None
+        ))
+
+    # speculative requests cancelled at the end may still land after the snapshot
+    assert sum(r["metrics"]["pages_fetched"] for r in results) <= len(session.stream.offsets)
+    for result in results:
+        assert result["metrics"]["pages_fetched"] >= 3
+        assert result["metrics"]["stages"]["score_comments"]["calls"] == 1
+
+
+def test_metrics_to_prometheus():
+    """Test the metrics render as Prometheus text, one sample per symbol and stage."""
+    metrics = gyc.Metrics()
+    metrics.add("_get_comments_block", 0.5)
+    metrics.add("_get_comments_block", 0.25)
+    metrics.count(requests=2, pages_fetched=2)
+    results = [{"symbol": "QBTS", "metrics": metrics.as_dict()}, {"symbol": "RGTI", "error": "boom"}]
+
+    text = gyc.metrics_to_prometheus(results)
+
+    assert 'yahoo_comments_stage_seconds{symbol="QBTS",stage="_get_comments_block"} 0.75' in text
+    assert 'yahoo_comments_stage_calls{symbol="QBTS",stage="_get_comments_block"} 2' in text
+    assert 'yahoo_comments_pages_fetched_total{symbol="QBTS"} 2' in text
+    assert "# TYPE yahoo_comments_requests_total counter" in text
+    assert "RGTI" not in text
+
+
+def test_base_urls_redirect_requests():
+    """Test both services can be pointed at a local stand-in."""
+    session = FakeSession(make_comments(10, 1732500000))
+    session.request = MagicMock(side_effect=session.request)
+
+    with patch('src.get_yahoo_comments._get_session', return_value=session), \
+            patch('src.get_yahoo_comments.YAHOO_BASE_URL', "http://127.0.0.1:8001"), \
+            patch('src.get_yahoo_comments.SPOTIM_BASE_URL', "http://127.0.0.1:8002"):
+        gyc._get_comments_block(gyc.get_conversation_info("QBTS"), 0)
+
+    urls = [c.args[1] for c in session.request.call_args_list]
+    assert urls == [
+        "http://127.0.0.1:8001/quote/QBTS/community",
+        "http://127.0.0.1:8002/v1.0.0/conversation/read",
+    ]
+
+
+@pytest.fixture
+def page_size():
+    yield
+    gyc.set_page_size(gyc.DEFAULT_PAGE_SIZE)
+
+
+def test_get_comments_block_keeps_only_needed_fields():
+    """Test content, replies and other nested fields are dropped at parse time."""
+    comment = {
+        "id": "c1",
+        "time": 1732500000,
+        "user_id": "u1",
+        "replies_count": 2,
+        "replies": [{"id": "r1", "content": [{"text": "reply"}]}],
+        "content": [{"type": "text", "text": "to the moon"}],
+        "rank": {"ranks_up": 3},
+        "additional_data": {"labels": {"ids": ["BULLISH"]}, "extra": "x"},
+    }
+    neutral = {"id": "c2", "time": 1732499999, "user_id": "u2", "content": []}
+    body = {"conversation": {"comments": [comment, neutral], "has_next": False, "users": {"u1": {}}}}
+
+    with patch('src.get_yahoo_comments._http_post') as mock_post:
+        mock_post.return_value.content = json.dumps(body).encode()
+        page = gyc._get_comments_block(CONVERSATION_INFO, 0)
+
+    assert page == {
+        "comments": [
+            gyc.Comment("c1", 1732500000, "u1", gyc.LABEL_FLAGS["BULLISH"], 2),
+            gyc.Comment("c2", 1732499999, "u2", 0, 0),
+        ],
+        "has_next": False,
+    }
+    assert gyc.score_comments(page["comments"])["bulls"] == 1
+
+
+def test_score_comments_memory_grows_with_users_not_comments(max_user_weight):
+    """Test scoring a long stream of few users keeps constant memory, weighting included."""
+    import tracemalloc
+
+    def peak(count):
+        stream = (
+            gyc.Comment(f"c{i}", 1732500000 - i, f"u_{i % 50}", i % 4, 0) for i in range(count)
+        )
+        tracemalloc.start()
+        try:
+            gyc.score_comments(stream)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    gyc.set_max_user_weight(3)
+    assert peak(200_000) < peak(20_000) + 50_000
+
+
+def test_comment_records_score_like_dicts():
+    """Test Comment records read, score and convert exactly like the raw dicts."""
+    comments_data = make_comments(200, 1732500000)
+    for i, comment in enumerate(comments_data):
+        comment["additional_data"] = {
+            "labels": {"ids": [["BULLISH"], ["BEARISH"], [], ["BULLISH", "BEARISH"]][i % 4]}
+        }
+    records = [gyc.Comment.from_dict(comment) for comment in comments_data]
+
+    assert records[0]["time"] == comments_data[0]["time"]
+    assert records[0].get("user_id") == comments_data[0]["user_id"]
+    assert records[0].get("content", "missing") == "missing"
+    assert gyc._comment_labels(records[3]) == ("BULLISH", "BEARISH")
+    with pytest.raises(KeyError):
+        records[0]["content"]
+
+    for record_users in (False, True):
+        assert gyc.score_comments(records, record_users=record_users) == \
+            gyc.score_comments(comments_data, record_users=record_users)
+    assert gyc.score_comments_vectorized(records) == gyc.score_comments(comments_data)
+    assert (gyc.comments_to_records(records) == gyc.comments_to_records(comments_data)).all()
+
+
+def test_page_size_falls_back_to_the_served_size(page_size):
+    """Test a page size the API caps is lowered to the size it serves."""
+    comments = make_comments(150, 1732500000)
+    gyc.set_page_size(500)
+
+    with patch('src.get_yahoo_comments._http_post') as mock_post:
+        mock_post.return_value.content = json.dumps(
+            {"conversation": {"comments": comments, "has_next": True}}
+        ).encode()
+        gyc._get_comments_block(CONVERSATION_INFO, 0)
+
+    assert json.loads(mock_post.call_args.kwargs["data"])["count"] == 500
+    assert gyc.PAGE_SIZE == 150
+
+
+def test_page_size_only_follows_top_level_pages(page_size):
+    """Test a short page of replies does not lower the page size."""
+    gyc.set_page_size(500)
+
+    with patch('src.get_yahoo_comments._http_post') as mock_post:
+        mock_post.return_value.content = json.dumps(
+            {"conversation": {"comments": make_comments(150, 1732500000), "has_next": True}}
+        ).encode()
+        gyc._get_replies_block(CONVERSATION_INFO, "c1", 0)
+
+    assert json.loads(mock_post.call_args.kwargs["data"])["count"] == 500
+    assert gyc.PAGE_SIZE == 500
+
+
+@pytest.fixture
+def max_user_weight():
+    yield
+    gyc.set_max_user_weight(0)
+
+
+def test_unique_users_and_capped_user_weight(max_user_weight):
+    """Test a repeat poster counts once per user and at most max_user_weight in weighted_score."""
+    def comment(i, user_id, labels):
+        return {"id": f"c{i}", "time": 1732500000 - i, "user_id": user_id,
+                "additional_data": {"labels": {"ids": labels}}}
+
+    comments_data = [comment(i, "spammer", ["BULLISH"]) for i in range(5)] + [
+        comment(5, "u2", ["BEARISH"]),
+        comment(6, "u3", []),
+        comment(7, None, ["BEARISH"]),
+    ]
+    gyc.set_max_user_weight(2)
+
+    result = gyc.score_comments(comments_data)
+
+    assert (result["bulls"], result["bears"], result["score"]) == (5, 2, 3)
+    assert (result["unique_users"], result["unique_bulls"], result["unique_bears"]) == (3, 1, 1)
+    assert result["weighted_score"] == 1
+    assert "users" not in result
+    assert gyc.score_comments_vectorized(comments_data) == result
+
+
+def test_user_stats_only_count_newly_cached_comments(comment_cache):
+    """Test the user index survives reruns over already cached comments without double counting."""
+    conversation_id = gyc._conversation_id(CONVERSATION_INFO)
+    gyc.ConversationConfig.create(symbol="QBTS", config=json.dumps(CONVERSATION_INFO), fetched_at=0)
+    comments = [
+        {"id": f"c{i}", "time": 1732500000 - i, "user_id": "u1" if i % 3 else "u2",
+         "additional_data": {"labels": {"ids": ["BULLISH"] if i % 2 else []}}}
+        for i in range(10)
+    ]
+
+    gyc._save_comments(conversation_id, comments[:6])
+    gyc._save_comments(conversation_id, comments[3:])
+
+    stats = {stat["user_id"]: stat for stat in gyc.top_users("QBTS")}
+    assert stats["u1"]["comments"] == 6
+    assert stats["u1"]["bulls"] == 3
+    assert stats["u2"]["comments"] == 4
+    assert stats["u2"]["first_seen"] == 1732500000 - 9
+    assert stats["u2"]["last_seen"] == 1732500000
+    assert list(stats) == ["u1", "u2"]
+
+
+def test_save_comments_from_concurrent_threads(comment_cache):
+    """Test concurrent page saves wait for the write lock instead of failing."""
+    def save(thread):
+        for page in range(20):
+            gyc._save_comments("conv", [
+                {"id": f"{thread}-{page}-{i}", "time": i, "user_id": f"u{i % 7}"} for i in range(50)
+            ])
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(save, range(4)))
+
+    assert gyc.UserStat.select(gyc.fn.SUM(gyc.UserStat.comments)).scalar() == 4 * 20 * 50
+
+def test_user_graph_cross_posters_and_crowd_overlap(comment_cache):
+    """Test the user x symbol CSR graph built from the user index."""
+    posts = {
+        "AAPL": ["u1", "u1", "u2", "u3"],
+        "MSFT": ["u1", "u2", "u4"],
+        "QBTS": ["u1", "u5"],
+    }
+    for symbol, users in posts.items():
+        conversation_info = {"spotId": "sp_test", "uuid": f"{symbol}_1"}
+        gyc.ConversationConfig.create(symbol=symbol, config=json.dumps(conversation_info), fetched_at=0)
+        gyc._save_comments(gyc._conversation_id(conversation_info), [
+            {"id": f"{symbol}{i}", "time": 1732500000 - i, "user_id": user_id}
+            for i, user_id in enumerate(users)
+        ])
+
+    graph = gyc.build_user_graph()
+
+    assert graph.symbols == ["AAPL", "MSFT", "QBTS"]
+    assert graph.cross_posters() == [
+        {"user_id": "u1", "symbols": ["AAPL", "MSFT", "QBTS"], "comments": 4},
+        {"user_id": "u2", "symbols": ["AAPL", "MSFT"], "comments": 2},
+    ]
+    overlap = {line["symbol"]: line for line in graph.crowd_overlap(chunk_rows=1)}
+    assert (overlap["AAPL"]["users"], overlap["AAPL"]["shared_users"]) == (3, 2)
+    assert overlap["AAPL"]["top_overlaps"][0] == {"symbol": "MSFT", "shared_users": 2, "jaccard": 0.5}
+    assert overlap["QBTS"]["crowd_overlap"] == 0.5
+    assert gyc.build_user_graph(["QBTS"]).cross_posters() == []
+
+
+def test_query_results_only_scores_missing_cells(comment_cache):
+    """Test finished days are stored and later queries only score what is missing."""
+    start_date, end_date = gyc.get_start_of_day("2024-11-18"), gyc.get_end_of_day("2024-11-20")
+    now = gyc.get_end_of_day("2024-11-20")
+    stream = FakeCommentStream(make_comments(300, now, step=900))
+    prices = {"current_price": 2.0}
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream), \
+            patch('src.get_yahoo_comments.get_conversation_info', return_value=CONVERSATION_INFO), \
+            patch('src.get_yahoo_comments.prefetch_prices'), \
+            patch('src.get_yahoo_comments.get_stock_info_by_day',
+                  side_effect=lambda symbol, days: {day: prices for day in days}) as mock_prices:
+        first = gyc.query_results(["QBTS", "RGTI"], start_date, end_date)
+        assert [(r["symbol"], r["start_date"]) for r in first] == [
+            (symbol, gyc.get_start_of_day(day))
+            for symbol in ["QBTS", "RGTI"]
+            for day in ["2024-11-18", "2024-11-19", "2024-11-20"]
+        ]
+        assert gyc.DailyResult.select().count() == 6
+
+        mock_prices.reset_mock()
+        assert gyc.query_results(["QBTS", "RGTI"], start_date, end_date) == first
+        mock_prices.assert_not_called()
+
+        gyc.DailyResult.delete().where(
+            (gyc.DailyResult.symbol == "RGTI") & (gyc.DailyResult.start_date == gyc.get_start_of_day("2024-11-19"))
+        ).execute()
+        assert [r["score"] for r in gyc.query_results(["QBTS", "RGTI"], start_date, end_date)] == \
+            [r["score"] for r in first]
+        mock_prices.assert_called_once_with("RGTI", ["2024-11-19"])
+
+
+def test_query_results_keeps_days_without_prices_and_matches_options(comment_cache):
+    """Test a weekend is stored despite its price error and other options score again."""
+    start_date, end_date = gyc.get_start_of_day("2024-11-16"), gyc.get_end_of_day("2024-11-17")
+    stream = FakeCommentStream(make_comments(300, end_date, step=900))
+    no_prices = lambda symbol, days: {day: {"error": f"No data found for {symbol} on {day}"} for day in days}
+    # what prefetch_prices caches for days without trading
+    gyc.PriceBar.insert_many([dict(symbol="QBTS", date="2024-11-16"), dict(symbol="QBTS", date="2024-11-17")]).execute()
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream), \
+            patch('src.get_yahoo_comments.get_conversation_info', return_value=CONVERSATION_INFO), \
+            patch('src.get_yahoo_comments.prefetch_prices'), \
+            patch('src.get_yahoo_comments.get_stock_info_by_day', side_effect=no_prices):
+        first = gyc.query_results(["QBTS"], start_date, end_date)
+        assert [r["error"] for r in first] == [
+            "No data found for QBTS on 2024-11-16", "No data found for QBTS on 2024-11-17"
+        ]
+        stream.offsets = []
+        assert gyc.query_results(["QBTS"], start_date, end_date) == first
+        assert stream.offsets == []
+
+        with_users = gyc.query_results(["QBTS"], start_date, end_date, record_users=True)
+        assert stream.offsets
+        assert all(r["bull_users"] for r in with_users)
+        assert gyc.query_results(["QBTS"], start_date, end_date, record_users=True) == with_users
+
+
+def test_query_results_reports_every_day_of_a_failed_shard(comment_cache):
+    """Test a shard that fails yields one error result for each of its days."""
+    start_date, end_date = gyc.get_start_of_day("2024-11-18"), gyc.get_end_of_day("2024-11-20")
+
+    with patch('src.get_yahoo_comments._backfill_shard', side_effect=ValueError("spot.im is down")):
+        results = gyc.query_results(["QBTS"], start_date, end_date, with_price=False)
+
+    assert [(r["start_date"], r["error"]) for r in results] == [
+        (gyc.get_start_of_day(day), "spot.im is down") for day in ["2024-11-18", "2024-11-19", "2024-11-20"]
+    ]
+
+
+@pytest.fixture
+def reply_expansion():
+    yield
+    gyc.set_reply_expansion(0)
+
+
+def test_iter_comments_expands_replies_with_capped_fan_out(reply_expansion):
+    """Test replies of threads are fetched, filtered to the range, deduplicated and capped."""
+    now = 1732500000
+    comments = make_comments(5, now)
+    for comment in comments[:4]:
+        comment["replies_count"] = 1
+    replies = {
+        "c0": [{"id": "r0", "time": now + 10, "replies_count": 1},  # nested thread
+               {"id": "late", "time": now + 10_000}],  # after end_date
+        "r0": [{"id": "r00", "time": now + 20}],
+        "c1": [{"id": "r1", "time": now + 30}, {"id": "r0", "time": now + 10}],  # duplicate
+        "c2": [{"id": "r2", "time": now + 40}],
+        "c3": [{"id": "r3", "time": now + 50}],
+    }
+    requested = []
+
+    def fake_replies_block(conversation_info, parent_id, offset):
+        requested.append(parent_id)
+        return {"comments": replies[parent_id][offset:offset + gyc.PAGE_SIZE], "has_next": False}
+
+    def expand(max_threads):
+        requested.clear()
+        gyc.set_reply_expansion(max_threads, concurrency=2)
+        metrics = gyc.Metrics()
+        token = gyc._metrics.set(metrics)
+        try:
+            result = list(gyc.iter_comments(CONVERSATION_INFO, now - 3600, now + 3600, seek=False))
+        finally:
+            gyc._metrics.reset(token)
+        return sorted(comment["id"] for comment in result), metrics.counters
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=FakeCommentStream(comments)), \
+            patch('src.get_yahoo_comments._get_replies_block', side_effect=fake_replies_block):
+        ids, counters = expand(10)
+        assert ids == ["c0", "c1", "c2", "c3", "c4", "r0", "r00", "r1", "r2", "r3"]
+        assert sorted(requested) == ["c0", "c1", "c2", "c3", "r0"]
+        assert (counters["reply_threads"], counters["reply_threads_skipped"]) == (5, 0)
+
+        replies["c0"][0]["replies_count"] = 0  # so the threads expanded do not depend on timing
+        ids, counters = expand(2)
+        assert ids == ["c0", "c1", "c2", "c3", "c4", "r0", "r1"]
+        assert sorted(requested) == ["c0", "c1"]
+        assert (counters["reply_threads"], counters["reply_threads_skipped"]) == (2, 2)
+
+
+def test_open_cache_adds_replies_count_to_old_caches(tmp_path):
+    """Test a cache created before reply expansion gains the replies_count column."""
+    import sqlite3
+
+    path = str(tmp_path / "old.db")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE cachedcomment (conversation_id VARCHAR(255) NOT NULL, comment_id VARCHAR(255) NOT NULL, "
+        "time INTEGER NOT NULL, user_id VARCHAR(255), labels VARCHAR(255) NOT NULL, "
+        "PRIMARY KEY (conversation_id, comment_id))"
+    )
+    connection.execute("INSERT INTO cachedcomment VALUES ('conv', 'c1', 1, 'u1', 'BULLISH')")
+    connection.commit()
+    connection.close()
+
+    gyc.open_cache(path)
+    try:
+        assert gyc.CachedComment.get().replies_count == 0
+    finally:
+        gyc.close_cache()
+
+
+def test_iter_comments_prunes_whole_pages_outside_the_range():
+    """Test pages newer than end_date are skipped whole and only boundary pages are filtered."""
+    import asyncio
+
+    now = 1732500000
+    comments = make_comments(1000, now)
+    start_date, end_date = comments[549]["time"], comments[250]["time"]
+    expected = [c["id"] for c in comments[250:550]]
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=FakeCommentStream(comments)):
+        result = gyc.profiled(lambda: {"ids": [
+            c["id"] for c in gyc.iter_comments(CONVERSATION_INFO, start_date, end_date, seek=False)
+        ]})
+        async_result = asyncio.run(gyc.async_profiled(lambda: _collect_ids(
+            gyc.aiter_comments(CONVERSATION_INFO, start_date, end_date, seek=False, prefetch=1)
+        )))
+
+    for run in (result, async_result):
+        assert run["ids"] == expected
+        assert (run["metrics"]["pages_skipped"], run["metrics"]["pages_scanned"]) == (2, 4)
+
+
+async def _collect_ids(async_iterable):
+    return {"ids": [comment["id"] async for comment in async_iterable]}
+
+
+@pytest.fixture
+def fetch_workers():
+    yield
+    gyc.set_fetch_workers(0)
+
+
+def test_sharded_fetch_matches_sequential_pager(fetch_workers):
+    """Test the parallel page fetch yields the same comments as the sequential pager."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(5000, now))
+    start_date, end_date = now - 4000 * 60, now - 700 * 60
+
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+        expected = [c["id"] for c in gyc.iter_comments(CONVERSATION_INFO, start_date, end_date)]
+        gyc.set_fetch_workers(8)
+        result = [c["id"] for c in gyc.iter_comments(CONVERSATION_INFO, start_date, end_date)]
+
+    assert result == expected
+    assert len(expected) == 3301
+
+
+def test_sharded_fetch_requests_about_as_many_pages_as_the_pager(fetch_workers):
+    """Test the parallel fetch seeks once and does not re-request the probed pages."""
+    now = 1732500000
+    stream = FakeCommentStream(make_comments(1000, now))
+
+    for start, end in [(600, 450), (900, 100), (999, 0), (150, 130)]:
+        start_date, end_date = now - start * 60, now - end * 60
+        with patch('src.get_yahoo_comments._get_comments_block', side_effect=stream):
+            gyc.set_fetch_workers(0)
+            stream.offsets = []
+            expected = list(gyc.iter_comments(CONVERSATION_INFO, start_date, end_date))
+            sequential = len(stream.offsets)
+            gyc.set_fetch_workers(8)
+            stream.offsets = []
+            result = list(gyc.iter_comments(CONVERSATION_INFO, start_date, end_date))
+
+        assert result == expected
+        assert len(stream.offsets) == len(set(stream.offsets))
+        assert len(stream.offsets) <= sequential + 1
+
+
+def test_sharded_fetch_survives_posts_arriving_mid_crawl(fetch_workers):
+    """Test comments shifting across page boundaries are neither lost nor duplicated."""
+    import threading
+
+    now = 1732500000
+    comments = make_comments(3000, now)
+
+    arrived_so_far = [0]
+
+    def shifting_stream(conversation_info, offset, *args, **kwargs):
+        if threading.current_thread() is threading.main_thread():
+            # seeks before the parallel fetch, refills after the pages they follow
+            arrived = arrived_so_far[0]
+        else:
+            # as if the pages were fetched deepest first with 25 posts arriving between
+            # two of them, more than the overlap of neighbouring pages absorbs
+            arrived = 25 * (3000 - offset) // 90
+            arrived_so_far[0] = max(arrived_so_far[0], arrived)
+        snapshot = [{"id": f"new{i}", "time": now + arrived - i} for i in range(arrived)] + comments
+        page = snapshot[offset:offset + gyc.PAGE_SIZE]
+        return {"comments": page, "has_next": offset + gyc.PAGE_SIZE < len(snapshot)}
+
+    start_date, end_date = now - 2500 * 60, now - 500 * 60
+    expected = [c["id"] for c in comments[500:2501]]
+
+    gyc.set_fetch_workers(4)
+    with patch('src.get_yahoo_comments._get_comments_block', side_effect=shifting_stream), \
+            patch('src.get_yahoo_comments._iter_pages', wraps=gyc._iter_pages) as mock_iter_pages:
+        result = [c["id"] for c in gyc.iter_comments(CONVERSATION_INFO, start_date, end_date)]
+
+    assert result == expected
+    assert mock_iter_pages.call_count > 1  # seams were refilled
+
+
+def test_main_fetch_workers_option(fetch_workers, http_settings):
+    """Test --fetch_workers turns on the sharded page fetch and sizes the connection pool for it."""
+    from click.testing import CliRunner
+
+    seen = []
+
+    def score_symbol(*args, **kwargs):
+        seen.append(gyc.FETCH_WORKERS)
+        return {"symbol": "QBTS"}
+
+    with patch('src.get_yahoo_comments.score_symbol', side_effect=score_symbol):
+        result = CliRunner().invoke(gyc.main, ["--symbol=QBTS", "--no_price", "--fetch_workers=8", "--concurrency=4"])
+
+    assert result.exit_code == 0, result.output
+    assert seen == [8]
+    assert gyc.HTTP_SETTINGS["pool_size"] == 32